@@ -9,6 +9,10 @@
 
 __all__ = (
   'api',
+  'bench',
   'cli',
-  'driver'
+  'driver',
+  'jobs',
+  'planner',
+  'sources'
 )
@@ -9,15 +9,66 @@
 # stdlib
 import os
 import pdb
-import glob
+import json
+import time
 import collections
 
 # imaging / NumPy
+import numpy
 from PIL import Image
 
 
 # local
-from . import base, driver
+from . import base, driver, planner, sources
+
+
+## Globals
+_QUALITY = 23  # default constant rate factor for ``auto`` bitrate
+
+
+def _complexity(img):
+
+  ''' Estimate how costly a frame is to encode, as its mean absolute luma
+      gradient. Flat frames score near ``0.0``, busy ones towards ``1.0``.
+
+      :param img: :py:class:`PIL.Image` frame, already resized.
+      :returns: ``float`` complexity score. '''
+
+  luma = numpy.asarray(img.convert('L'), dtype=numpy.float32) / 255.0
+  return float(numpy.abs(numpy.diff(luma, axis=0)).mean() + numpy.abs(numpy.diff(luma, axis=1)).mean())
+
+
+def _clock():
+
+  ''' Sample wall time, CPU time for this process and CPU time for
+      waited-on child processes (like ``FFmpeg``), in one go.
+
+      :returns: ``(wall, cpu, children_cpu)`` tuple, in seconds. '''
+
+  times = os.times()
+  return time.time(), times[0] + times[1], times[2] + times[3]
+
+
+def _timed(iterable, spent):
+
+  ''' Iterate over ``iterable``, adding the wall and CPU time spent waiting
+      on each item to ``spent``, so time spent fetching or unpacking source
+      images can be told apart from time spent processing them.
+
+      :param iterable: Iterable to time.
+      :param spent: ``dict`` with ``wall`` and ``cpu`` keys, updated in place.
+      :returns: Generator over the items of ``iterable``. '''
+
+  iterator = iter(iterable)
+  while True:
+    before = _clock()
+    try:
+      item = next(iterator)
+    finally:
+      after = _clock()
+      spent['wall'] += after[0] - before[0]
+      spent['cpu'] += after[1] - before[1]
+    yield item
 
 
 class MomentOptions(object):
@@ -26,7 +77,7 @@ class MomentOptions(object):
       instance and production run. '''
 
   ## Input/Output
-  __source__ = None  # source images - glob or directory string
+  __source__ = None  # source images - glob, URL, archive, or a list of any of them
   __target__ = None  # video target - where to put the finished video
 
   ## Options
@@ -41,6 +92,14 @@ class MomentOptions(object):
   __loop__ = None  # loop the video until audio is done
   __safe__ = None  # whether to overwrite target files
   __length__ = None  # the output video's ending length
+  __dry_run__ = None  # only plan the run and estimate its cost, don't render
+  __history__ = None  # path to recorded run history, for cost estimates
+  __codec__ = None  # video encoder to use (defaults to ``libx264``)
+  __preset__ = None  # encoder speed/compression preset, if any
+  __crf__ = None  # constant rate factor - use constant quality instead of ``bitrate``
+  __tune__ = None  # encoder tuning for the content type, if any
+  __quality__ = None  # constant rate factor to aim for when ``bitrate`` is ``auto``
+  __concurrency__ = None  # maximum concurrent fetches, for URL sources
 
   def __init__(self, **options):
 
@@ -69,6 +128,14 @@ class MomentOptions(object):
   loop = property(lambda self: self.__loop__)
   safe = property(lambda self: self.__safe__)
   length = property(lambda self: self.__length__)
+  dry_run = property(lambda self: self.__dry_run__)
+  history = property(lambda self: self.__history__)
+  codec = property(lambda self: self.__codec__)
+  preset = property(lambda self: self.__preset__)
+  crf = property(lambda self: self.__crf__)
+  tune = property(lambda self: self.__tune__)
+  quality = property(lambda self: self.__quality__)
+  concurrency = property(lambda self: self.__concurrency__)
 
 
 class Moment(base.MomentBase):
@@ -81,6 +148,7 @@ class Moment(base.MomentBase):
   __target__ = None  # actual handle to output video (not config, like above)
   __driver__ = None  # driver to `ffmpeg`, which subprocesses when neccessary
   __options__ = None  # additional options that were set upon invocation
+  __stats__ = None  # timings and sizes recorded during the current run
 
   ## Descriptors
   __stdin__, __stdout__, __stderr__ = None, None, None  # standard in, out and err
@@ -90,7 +158,8 @@ class Moment(base.MomentBase):
     ''' Initialize a new :py:class:`Moment` with configuration and
         details.
 
-        :param source: Glob or string path to a directory full of images.
+        :param source: Glob, HTTP(S) URL, archive (``album.zip!*.jpg``), or a
+        ``list`` of any of them.
         :param target: String destination path for the resulting video.
         :param driver: Replacement ``driver`` to use in place of :py:class:`driver.FFmpeg`.
         :returns: Nothing, as this is a constructor. '''
@@ -99,6 +168,7 @@ class Moment(base.MomentBase):
     self.__options__ = MomentOptions(source=source, target=target, **options)
     self.__driver__ = (_driver or driver.FFmpeg)(self)
     self.__source__ = collections.deque()
+    self.__stats__ = {}
 
   ## == Internals == ##
   def _resize_and_crop(self, img, modified_paths, size, crop_type='middle'):
@@ -155,6 +225,29 @@ class Moment(base.MomentBase):
 
       for modified_path in ([modified_paths] if not isinstance(modified_paths, (list, tuple)) else modified_paths):
         img.save(modified_path)
+      return img
+
+  def _discover_input(self, source=None):
+
+    ''' Scan the configured source for input images, without opening
+        any of them.
+
+        :param source: Alternate source, to override ``self.options.source``.
+        Defaults to ``None``.
+
+        :returns: ``list`` of ``(image_i, input_item)`` pairs. '''
+
+    return list(enumerate(sources.discover(source or self.options.source)))
+
+  def _frames_per_image(self, count):
+
+    ''' Calculate how many frames each source image is held on screen
+        for, given the desired video length and framerate.
+
+        :param count: Number of source images in the video.
+        :returns: ``int`` number of frames to write per source image. '''
+
+    return (self.options.length * int(self.options.framerate)) // count if count else 0
 
   def _validate_input(self, source=None):
 
@@ -168,22 +261,24 @@ class Moment(base.MomentBase):
         :returns: ``self``, for easy chainability. '''
 
     # scan globbed matches
-    _buffer = []
-    for image_i, input_item in enumerate(glob.iglob(source or self.options.source)):
-      _buffer.append((image_i, input_item))
+    _buffer = self._discover_input(source)
+    _frames = self._frames_per_image(len(_buffer))
+    self.__stats__.update(images=len(_buffer), source_pixels=0, complexity=[],
+                          remote=sum(1 for _, item in _buffer if sources.is_remote(item)),
+                          fetch={'wall': 0.0, 'cpu': 0.0})
 
-    for image_i, input_item in _buffer:
+    # remote images are decoded as they arrive, local ones as they're opened
+    for image_i, input_item, target_image in _timed(sources.stream(_buffer, self.options.concurrency),
+                                                    self.__stats__['fetch']):
 
-      try:
-        os.stat(input_item)
-      except:
+      if target_image is None:
         if self.options.debug: pdb.set_trace()
         self.logging.critical('Moment tool encountered fatal error scanning input item: "%s".' % input_item)
       else:
         self.logging.info('Found valid source image "%s"...' % input_item)
 
         # open up image and make sure aspect ratio/format/size is all good
-        with open(input_item, 'rb') as target_image:
+        with target_image:
 
           # open in PIL
           img = Image.open(target_image)
@@ -191,6 +286,7 @@ class Moment(base.MomentBase):
 
           # calculate aspect ratio
           width, height = img.size
+          self.__stats__['source_pixels'] += width * height
           ratio = max(float(self.options.size) / width, float(self.options.size) / height)
 
           if self.options.debug:
@@ -202,10 +298,12 @@ class Moment(base.MomentBase):
           try:
 
             _target_paths = []
-            for frame_i in xrange(0, ((self.options.length * int(self.options.framerate)) / len(_buffer))):
+            for frame_i in xrange(0, _frames):
               _target_paths.append('.'.join((os.path.join(self.driver.scratch, "frame_%s%s" % (str(image_i).zfill(3), str(frame_i).zfill(3))), 'jpg')))
 
-            self._resize_and_crop(img, _target_paths, (self.options.size, self.options.size))
+            frame = self._resize_and_crop(img, _target_paths, (self.options.size, self.options.size))
+            if self.options.bitrate == 'auto':
+              self.__stats__['complexity'].append(_complexity(frame))
 
             if self.options.verbose:
               self.logging.debug('... generated thumbnail of size %s at:' % str((self.options.size, self.options.size)))
@@ -247,7 +345,182 @@ class Moment(base.MomentBase):
     self.__target__ = target  # set local target
     return self
 
+  def _make_args(self, target=None, **encoder):
+
+    ''' Build the ``FFmpeg`` argument list that encodes frames from the
+        driver's scratch space into a video.
+
+        :param target: Alternate target, to override ``self.target``.
+        Defaults to ``None``.
+
+        :param encoder: Overrides for encoder options (``codec``, ``preset``,
+        ``crf``, ``tune`` and ``bitrate``), which otherwise come from
+        ``self.options``.
+
+        :returns: ``list`` of string arguments for ``FFmpeg``. '''
+
+    codec, preset, crf, tune, bitrate = (
+      encoder.get(key, getattr(self.options, key)) for key in ('codec', 'preset', 'crf', 'tune', 'bitrate')
+    )
+
+    filters = ",".join([  # video filters (watermark, then base filters)
+      "movie=resources/watermark.png [watermark]; [in][watermark] overlay=main_w-overlay_w-10:main_h-overlay_h-10 [out]"
+    ])
+
+    # calculate target glob and audio
+    target_glob = os.path.join(self.driver.scratch, "frame_*.jpg")
+    audio = [] if not self.options.audio else [i for i in [
+      "-i",
+      self.options.audio,
+      "-b:a",
+      "192k",
+      "-c:a",
+      "aac",
+      "-strict",
+      "-2",
+      "-b:a",
+      "64k",
+      "-loop" if self.options.loop else None,
+      "1" if self.options.loop else None
+    ] if i is not None]
+
+    # constant quality (optionally capped at ``bitrate``), or average bitrate
+    if crf is not None:
+      rate = ["-crf", "%s" % crf] + ([
+        "-maxrate", "%s" % bitrate, "-bufsize", "%s" % (2 * planner.parse_bitrate(bitrate))
+      ] if bitrate else [])
+    else:
+      rate = ["-b:v", "%s" % bitrate]
+
+    return [
+
+      "-r",                                     # input rate
+      "%s" % self.options.framerate,            # == framerate
+      "-pattern_type",                          # set pattern type
+      "glob",                                   # == glob
+      "-i",                                     # input flag
+      '%s' % target_glob,                       # == input glob
+      ] + audio + [
+      "-c:v",                                   # video codec
+      codec or "libx264",                       # == encoder
+      ] + (["-preset", preset] if preset else []) + (["-tune", tune] if tune else []) + [
+      "-vf",                                    # add video filter
+      filters,                                  # == filter for FPS rate and chroma
+      "-pix_fmt",                               # picture format
+      "yuv420p",                                # == currently JPEG
+      ] + rate + [                              # video bitrate or quality
+      "-y" if not self.options.safe else "-n",  # overwrite output or not
+      "-t",                                     # output time
+      "%s" % self.options.length,               # output video length
+      target or self.target                     # output video location
+
+    ]
+
+  def _select_rate(self):
+
+    ''' Pick encoder settings for ``auto`` bitrate: constant quality at the
+        ``quality`` CRF, unless an explicit ``crf`` option overrides it. The
+        complexity of the frames rendered by :py:meth:`_validate_input` is
+        recorded alongside, so the CRF can later be tuned per album from
+        ``moment bench`` results.
+
+        :returns: ``dict`` of encoder settings (``crf``, plus ``bitrate``
+        as ``None``), which is also recorded in ``self.stats['encoder']``. '''
+
+    complexities = self.stats.get('complexity')
+    if self.options.crf is not None:
+      crf = self.options.crf
+    else:
+      crf = self.options.quality if self.options.quality is not None else _QUALITY
+
+    encoder = {
+      'crf': min(max(int(crf), 0), 51),  # x264's CRF range
+      'bitrate': None,
+      'complexity': {
+        'mean': float(numpy.mean(complexities)),
+        'p90': float(numpy.percentile(complexities, 90))
+      } if complexities else None
+    }
+    self.__stats__['encoder'] = encoder
+    return encoder
+
+  def _make_plan(self, images, source_pixels, remote=0):
+
+    ''' Assemble a run plan from the results of input discovery.
+
+        :param images: Number of source images in the video.
+        :param source_pixels: Total pixel count across all source images.
+        :param remote: Number of source images fetched over HTTP or read out
+        of an archive. Defaults to ``0``.
+        :returns: ``dict`` describing the planned run. '''
+
+    frames = self._frames_per_image(images)
+    return {
+      'source': self.options.source,
+      'images': images,
+      'frames_per_image': frames,
+      'frames': frames * images,
+      'source_pixels': source_pixels,
+      'remote': remote,
+      'size': (self.options.size, self.options.size),
+      'length': self.options.length,
+      'bitrate': self.options.bitrate
+    }
+
+  def _probe_size(self, handle):
+
+    ''' Read an image's dimensions from its header, without decoding it.
+
+        :param handle: Readable file-like object, or ``None``.
+        :returns: ``(width, height)`` tuple, or ``None`` if the header
+        couldn't be read. '''
+
+    if handle is None:
+      return None
+    try:
+      with handle:
+        return Image.open(handle).size
+    except IOError:
+      return None
+
+  def _measure_scratch(self):
+
+    ''' Total up the bytes currently written to the driver's scratch space.
+
+        :returns: ``int`` size of scratch space contents, in bytes. '''
+
+    return sum(os.path.getsize(os.path.join(self.driver.scratch, name))
+               for name in os.listdir(self.driver.scratch))
+
   ## == Public == ##
+  def plan(self, source=None):
+
+    ''' Plan a run without rendering anything: discover input images,
+        probe their headers for dimensions, calculate the planned frame
+        count and estimate the cost of each stage from past runs.
+
+        :param source: Alternate source, to override ``self.options.source``.
+        Defaults to ``None``.
+
+        :returns: ``dict`` describing the planned run, with estimates
+        under the ``estimate`` key. '''
+
+    _buffer = self._discover_input(source)
+
+    source_pixels = 0
+    for image_i, input_item, target_image in sources.stream(_buffer, self.options.concurrency, probe=True):
+      size = self._probe_size(target_image)
+      if size is None:  # the header may sit past the probed bytes (big EXIF/ICC segments), so read it all
+        size = self._probe_size(list(sources.stream([(image_i, input_item)], self.options.concurrency))[0][2])
+      if size is None:
+        self.logging.warning('Could not probe source image "%s".' % input_item)
+        continue
+      source_pixels += size[0] * size[1]
+
+    plan = self._make_plan(len(_buffer), source_pixels, sum(1 for _, item in _buffer if sources.is_remote(item)))
+    plan['estimate'] = planner.CostModel(self.options.history).estimate(plan)
+    return plan
+
   def __call__(self, stdin, stdout, stderr):
 
     ''' Call override that provides an interface for CLI or API-based
@@ -267,59 +540,50 @@ class Moment(base.MomentBase):
       stdin, stdout, stderr
     )
 
+    # plan only, if asked - nothing is rendered
+    if self.options.dry_run:
+      self.stdout.write(json.dumps(self.plan(), indent=2, sort_keys=True) + '\n')
+      return True
+
     # acquire driver and start working
     with self.driver as ffmpeg:
 
       # check input and gather files
+      started = _clock()
       if self._validate_input() and self._validate_output():
+        resized = _clock()
         self.logging.info('Creating new Moment from %s input images...' % len(self.source))
 
-        filters = ",".join([  # video filters (watermark, then base filters)
-          "movie=resources/watermark.png [watermark]; [in][watermark] overlay=main_w-overlay_w-10:main_h-overlay_h-10 [out]"
-        ])
-
-        # calculate target glob and audio
-        target_glob = os.path.join(self.driver.scratch, "frame_*.jpg")
-        audio = [] if not self.options.audio else [i for i in [
-          "-i",
-          self.options.audio,
-          "-b:a",
-          "192k",
-          "-c:a",
-          "aac",
-          "-strict",
-          "-2",
-          "-b:a",
-          "64k",
-          "-loop" if self.options.loop else None,
-          "1" if self.options.loop else None
-        ] if i is not None]
-
-        ffargs = [
-
-          "-r",                                     # input rate
-          "%s" % self.options.framerate,            # == framerate
-          "-pattern_type",                          # set pattern type
-          "glob",                                   # == glob
-          "-i",                                     # input flag
-          '%s' % target_glob,                       # == input glob
-          ] + audio + [
-          "-c:v",                                   # ??? (maybe 'create video?')
-          "libx264",                                # output muxer
-          "-vf",                                    # add video filter
-          filters,                                  # == filter for FPS rate and chroma
-          "-pix_fmt",                               # picture format
-          "yuv420p",                                # == currently JPEG
-          "-b:v",                                   # video bitrate
-          "%s" % self.options.bitrate,              # == bitrate
-          "-y" if not self.options.safe else "-n",  # overwrite output or not
-          "-t",                                     # output time
-          "%s" % self.options.length,               # output video length
-          self.target                               # output video location
-
-        ]
-
-        ffmpeg(*ffargs)  # execute! :)
+        encoder = {}
+        if self.options.bitrate == 'auto':
+          encoder = self._select_rate()
+          self.logging.info('Selected CRF %s.' % encoder['crf'])
+
+        returncode = ffmpeg(*self._make_args(crf=encoder.get('crf', self.options.crf),
+                                             bitrate=encoder.get('bitrate', self.options.bitrate)))  # execute! :)
+        encoded = _clock()
+
+        if returncode == 0:
+          plan = self._make_plan(self.stats['images'], self.stats['source_pixels'], self.stats['remote'])
+          fetch = self.stats['fetch']
+          self.__stats__.update(measured={
+            'fetch_wall': fetch['wall'],
+            'fetch_cpu': fetch['cpu'],
+            'resize_wall': resized[0] - started[0] - fetch['wall'],
+            'resize_cpu': resized[1] - started[1] - fetch['cpu'],
+            'encode_wall': encoded[0] - resized[0],
+            'encode_cpu': encoded[2] - resized[2],
+            'scratch_bytes': self._measure_scratch(),
+            'output_bytes': os.path.getsize(self.target)
+          })
+          try:
+            planner.CostModel(self.options.history).record(plan, self.stats['measured'],
+                                                             encoder=self.stats.get('encoder'))
+          except (IOError, OSError) as e:  # the render itself still succeeded
+            self.logging.warning('Failed to record run history: %s.' % e)
+          return True  # run succeeded
+
+        self.logging.critical('FFmpeg exited with code %s.' % returncode)
 
       else:
         self.logging.critical("Input files failed validation. Exiting.")
@@ -334,5 +598,6 @@ class Moment(base.MomentBase):
   stdout = property(lambda self: self.__stdout__)  # standard out
   stderr = property(lambda self: self.__stderr__)  # standard err
 
+  stats = property(lambda self: self.__stats__)  # recorded run timings and sizes
   driver = property(lambda self: self.__driver__)  # mapped ffmpeg driver
   options = property(lambda self: self.__options__)  # configuration options
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+'''
+
+  yapa moments demo: encoder benchmark
+
+'''
+
+# stdlib
+import os
+import re
+import shutil
+import tempfile
+import itertools
+
+# local
+from . import api, base, driver
+
+
+## Globals
+_PRESETS = ('ultrafast', 'veryfast', 'medium', 'slow')  # default x264 presets to try
+_CRFS = (18, 23, 28)  # default constant rate factors to try
+_TUNES = (None, 'stillimage')  # default x264 tunings to try
+_BASELINE = {'preset': None, 'crf': None, 'tune': None, 'bitrate': '5000k'}  # the original fixed-bitrate settings
+_REFERENCE = {'preset': 'ultrafast', 'crf': 0, 'tune': None, 'bitrate': None}  # lossless reference encode
+
+_SSIM = re.compile(r'SSIM .*All:([0-9.]+)')  # overall SSIM, from FFmpeg's ``ssim`` filter
+_PSNR = re.compile(r'PSNR .*average:([0-9.]+|inf)')  # average PSNR, from FFmpeg's ``psnr`` filter
+
+
+def matrix(presets=_PRESETS, crfs=_CRFS, tunes=_TUNES):
+
+  ''' Build the matrix of encoder settings to benchmark, which is every
+      combination of ``presets``, ``crfs`` and ``tunes`` plus the baseline
+      fixed-bitrate settings ``moment create`` originally used.
+
+      :param presets: Iterable of encoder presets.
+      :param crfs: Iterable of constant rate factors.
+      :param tunes: Iterable of encoder tunings (``None`` for no tuning).
+      :returns: ``list`` of encoder settings ``dict``s. '''
+
+  return [dict(_BASELINE)] + [
+    {'preset': preset, 'crf': crf, 'tune': tune, 'bitrate': None}
+    for preset, crf, tune in itertools.product(presets, crfs, tunes)
+  ]
+
+
+def _dominates(a, b):
+
+  ''' Decide whether result ``a`` is at least as good as ``b`` on encode
+      CPU time, output size and quality, and strictly better on one.
+
+      :param a: ``dict`` benchmark result.
+      :param b: ``dict`` benchmark result.
+      :returns: ``True`` if ``a`` Pareto-dominates ``b``. '''
+
+  no_worse = a['encode_cpu'] <= b['encode_cpu'] and a['bytes'] <= b['bytes'] and a['ssim'] >= b['ssim']
+  better = a['encode_cpu'] < b['encode_cpu'] or a['bytes'] < b['bytes'] or a['ssim'] > b['ssim']
+  return no_worse and better
+
+
+class Benchmark(base.MomentBase):
+
+  ''' Renders a reference album's frames once, then encodes them under a
+      matrix of encoder settings, scoring each for encode time, output size
+      and objective quality against a lossless reference encode. '''
+
+  __source__ = None  # source images to benchmark with
+  __matrix__ = None  # encoder settings to benchmark
+  __options__ = None  # options for the underlying :py:class:`moments.api.Moment`
+
+  def __init__(self, source, settings=None, **options):
+
+    ''' Initialize a :py:class:`Benchmark` over a set of source images.
+
+        :param source: Glob or string path to a directory full of images.
+        :param settings: ``list`` of encoder settings to try. Defaults to :py:func:`matrix`.
+        :param options: Options for the underlying :py:class:`moments.api.Moment`.
+        :returns: Nothing, as this is a constructor. '''
+
+    options.update(audio=None, safe=False)  # video only, and outputs are scratch
+    self.__source__, self.__matrix__, self.__options__ = (
+      source, settings or matrix(), options
+    )
+
+  ## == Internals == ##
+  def _encode(self, moment, target, **settings):
+
+    ''' Encode the moment's rendered frames to ``target`` and measure it.
+
+        :param moment: :py:class:`moments.api.Moment` with frames rendered.
+        :param target: String path to write the encoded video to.
+        :param settings: Encoder settings to use.
+        :raises RuntimeError: If ``FFmpeg`` fails.
+        :returns: ``dict`` of encode wall time, CPU time and output bytes. '''
+
+    started = api._clock()
+    returncode = driver.FFmpeg(moment, capture=True)(*moment._make_args(target, **settings))
+    finished = api._clock()
+
+    if returncode != 0:
+      raise RuntimeError('FFmpeg failed to encode benchmark settings %s.' % settings)
+    return {
+      'encode_wall': finished[0] - started[0],
+      'encode_cpu': finished[2] - started[2],
+      'bytes': os.path.getsize(target)
+    }
+
+  def _score(self, moment, target, reference):
+
+    ''' Measure the objective quality of ``target`` against ``reference``,
+        using ``FFmpeg``'s own ``ssim`` and ``psnr`` filters.
+
+        :param moment: :py:class:`moments.api.Moment` being benchmarked.
+        :param target: String path to the encoded video to score.
+        :param reference: String path to the reference video.
+        :raises RuntimeError: If ``FFmpeg`` fails or reports no scores.
+        :returns: ``dict`` with ``ssim`` and ``psnr`` scores. PSNR is ``None``
+        when the output is identical to the reference (infinite PSNR, which
+        JSON can't represent). '''
+
+    ffmpeg = driver.FFmpeg(moment, capture=True)
+    returncode = ffmpeg('-i', target, '-i', reference, '-lavfi', '[0:v][1:v]ssim;[0:v][1:v]psnr', '-f', 'null', '-')
+    stderr = ffmpeg.output[1].decode('utf-8', 'replace')
+    ssim, psnr = _SSIM.search(stderr), _PSNR.search(stderr)
+
+    if returncode != 0 or not (ssim and psnr):
+      raise RuntimeError('FFmpeg failed to score benchmark output "%s".' % target)
+    return {'ssim': float(ssim.group(1)), 'psnr': None if psnr.group(1) == 'inf' else float(psnr.group(1))}
+
+  ## == Public == ##
+  def run(self):
+
+    ''' Run the benchmark.
+
+        :returns: ``list`` of results, one per encoder setting, ordered by
+        encode CPU time. Each carries its settings, measurements, scores and
+        a ``pareto`` flag marking the speed/size/quality Pareto front.
+        Settings that failed to encode or score carry an ``error`` instead,
+        and are listed last. '''
+
+    workdir = tempfile.mkdtemp()
+    reference = os.path.join(workdir, 'reference.mp4')
+    moment = api.Moment(self.source, reference, **self.options)
+
+    try:
+      with moment.driver:
+        moment._validate_input()  # frames are rendered once, for every encode
+        self._encode(moment, reference, **_REFERENCE)
+
+        results = []
+        for index, settings in enumerate(self.matrix):
+          target = os.path.join(workdir, 'candidate-%s.mp4' % index)
+          result = dict(settings)
+          try:
+            result.update(self._encode(moment, target, **settings))
+            result.update(self._score(moment, target, reference))
+          except (RuntimeError, IOError, OSError) as e:  # one bad setting shouldn't sink the whole run
+            self.logging.error('Failed to benchmark %s: %s' % (settings, e))
+            result['error'] = str(e)
+          else:
+            self.logging.info('Benchmarked %s: %s.' % (settings, result))
+          results.append(result)
+    finally:
+      shutil.rmtree(workdir, ignore_errors=True)
+
+    scored = [result for result in results if 'error' not in result]
+    for result in results:
+      result['pareto'] = 'error' not in result and not any(_dominates(other, result) for other in scored)
+    return sorted(results, key=lambda result: ('error' in result, result.get('encode_cpu')))
+
+  ## == Property Mappings == ##
+  source = property(lambda self: self.__source__)  # source images
+  matrix = property(lambda self: self.__matrix__)  # encoder settings
+  options = property(lambda self: self.__options__)  # moment options
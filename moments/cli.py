@@ -7,13 +7,15 @@
 '''
 
 # stdlib
+import os
 import sys
+import json
 import pdb
 import logging
 import traceback
 
 # local
-from . import api
+from . import api, jobs, bench, sources
 
 # canteen
 from canteen.util import cli
@@ -37,15 +39,24 @@ class Moment(cli.Tool):
         via CLI. '''
 
     arguments = (
-      ('--input', '-i', {'type': str, 'help': 'globbed path of source images'}),
+      ('--input', '-i', {'type': str, 'action': 'append', 'help': 'globbed path, HTTP(S) URL, or archive (like "album.zip!*.jpg") of source images (repeatable)'}),
       ('--output', '-o', {'type': str, 'help': 'full path to desired video output location'}),
       ('--audio', '-a', {'type': str, 'help': 'full path to an audio track to attach'}),
       ('--framerate', '-f', {'type': str, 'help': 'input framerate to enforce for reading sources (default: 1)'}),
-      ('--bitrate', '-b', {'type': str, 'help': 'desired video bitrate (default: "5000k")'}),
+      ('--bitrate', '-b', {'type': str, 'help': 'desired video bitrate, bitrate cap with --crf, or "auto" for constant quality at --quality (default: "auto" without --crf)'}),
+      ('--quality', '-g', {'type': int, 'help': 'constant rate factor to encode at with "auto" bitrate (default: 23)'}),
+      ('--codec', '-c', {'type': str, 'help': 'video encoder to use (default: "libx264")'}),
+      ('--preset', '-e', {'type': str, 'help': 'encoder speed/compression preset, like "veryfast" or "slow"'}),
+      ('--crf', '-C', {'type': int, 'help': 'encode at this constant rate factor, instead of a fixed bitrate'}),
+      ('--tune', '-u', {'type': str, 'help': 'encoder tuning for the content, like "stillimage"'}),
       ('--size', '-s', {'type': int, 'help': 'desired size of the smaller output video dimension (default: 300px)'}),
       ('--loop', '-l', {'action': 'store_true', 'help': 'loop the video until the audio is finished (does nothing with no audio)'}),
       ('--length', '-t', {'type': int, 'help': 'the desired length of the output video'}),
-      ('--safe', '-n', {'action': 'store_false', 'help': 'don\'t overwrite existing videos (disabled by default)'})
+      ('--safe', '-n', {'action': 'store_false', 'help': 'don\'t overwrite existing videos (disabled by default)'}),
+      ('--dry-run', '-r', {'action': 'store_true', 'help': 'plan the run and print estimated cost as JSON, without rendering'}),
+      ('--queue', '-Q', {'type': str, 'help': 'submit the moment to the job queue at this path, instead of rendering it'
+                                        ' (shared queues need working file locks - not NFS - and synced clocks)'}),
+      ('--concurrency', '-k', {'type': int, 'help': 'maximum concurrent fetches for URL sources (default: 8)'})
     )
 
     def execute(arguments):
@@ -59,19 +70,41 @@ class Moment(cli.Tool):
           :returns: Exits directly with Unix-compliant exit code. '''
 
       try:
-        return sys.exit(1 if not api.Moment(arguments.input, arguments.output, **{
+        options = {
           'audio': arguments.audio or None,
           'debug': arguments.debug or False,
           'quiet': arguments.quiet or False,
           'verbose': arguments.verbose or (arguments.debug or False),
           'framerate': arguments.framerate or '1',
-          'bitrate': arguments.bitrate or '5000k',
+          'bitrate': arguments.bitrate or (None if arguments.crf is not None else 'auto'),
+          'quality': arguments.quality if arguments.quality is not None else 23,
+          'codec': arguments.codec or 'libx264',
+          'preset': arguments.preset or None,
+          'crf': arguments.crf,
+          'tune': arguments.tune or None,
           'progress': arguments.progress or True,
           'size': arguments.size or 500,
           'loop': arguments.loop or False,
           'length': arguments.length or 60,
-          'safe': not (arguments.safe or True)
-        })(sys.stdin, sys.stdout, sys.stderr) else 0)
+          'safe': not (arguments.safe or True),
+          'dry_run': arguments.dry_run or False,
+          'concurrency': arguments.concurrency or 8
+        }
+
+        if arguments.queue:
+          if arguments.dry_run:
+            logging.critical('Cannot submit a dry run to the job queue. Exiting.')
+            return sys.exit(1)
+
+          options['audio'] = options['audio'] and os.path.abspath(options['audio'])
+          job = jobs.Queue(arguments.queue).submit(  # workers may run from anywhere
+            [item if sources.is_url(item) else os.path.abspath(item) for item in arguments.input],
+            os.path.abspath(arguments.output), **options)
+          sys.stdout.write('%s\n' % job)
+          return sys.exit(0)
+
+        return sys.exit(1 if not api.Moment(arguments.input, arguments.output, **options)(
+          sys.stdin, sys.stdout, sys.stderr) else 0)
 
       except Exception:
 
@@ -81,5 +114,102 @@ class Moment(cli.Tool):
           logging.critical('Moment tool encountered a fatal error. Exiting.')
         return sys.exit(1)
 
+  class Bench(cli.Tool):
+
+    ''' Benchmarks a matrix of encoder settings against a reference album,
+        reporting encode time, output size and quality for each. '''
+
+    arguments = (
+      ('--input', '-i', {'type': str, 'help': 'globbed path of reference source images'}),
+      ('--framerate', '-f', {'type': str, 'help': 'input framerate to enforce for reading sources (default: 1)'}),
+      ('--size', '-s', {'type': int, 'help': 'desired size of the smaller output video dimension (default: 500px)'}),
+      ('--length', '-t', {'type': int, 'help': 'the desired length of the output video (default: 60)'}),
+      ('--presets', '-e', {'type': str, 'help': 'comma-separated encoder presets to try'}),
+      ('--crfs', '-C', {'type': str, 'help': 'comma-separated constant rate factors to try'}),
+      ('--tunes', '-u', {'type': str, 'help': 'comma-separated encoder tunings to try ("none" for no tuning)'})
+    )
+
+    def execute(arguments):
+
+      ''' Executes the :py:class:`Moment.Bench` flow, which prints benchmark
+          results as JSON, with Pareto-optimal settings flagged.
+
+          :param arguments: :py:class:`argparse.Arguments` object indicating
+          desired arguments, as provided by Canteen's :py:class:`cli.Tool` system.
+
+          :returns: Exits directly with Unix-compliant exit code. '''
+
+      try:
+        presets, crfs, tunes = (
+          (arguments.presets.split(',') if arguments.presets else bench._PRESETS),
+          ([int(crf) for crf in arguments.crfs.split(',')] if arguments.crfs else bench._CRFS),
+          ([(None if tune == 'none' else tune) for tune in arguments.tunes.split(',')] if arguments.tunes else bench._TUNES)
+        )
+
+        results = bench.Benchmark(arguments.input, bench.matrix(presets, crfs, tunes), **{
+          'debug': arguments.debug or False,
+          'quiet': arguments.quiet or False,
+          'verbose': arguments.verbose or (arguments.debug or False),
+          'framerate': arguments.framerate or '1',
+          'bitrate': '5000k',
+          'codec': 'libx264',
+          'size': arguments.size or 500,
+          'length': arguments.length or 60
+        }).run()
+
+        sys.stdout.write(json.dumps(results, indent=2, sort_keys=True) + '\n')
+        return sys.exit(0)
+
+      except Exception:
+
+        if arguments.debug: pdb.set_trace()
+        if not arguments.quiet:
+          traceback.print_exception(*sys.exc_info())
+          logging.critical('Moment benchmark encountered a fatal error. Exiting.')
+        return sys.exit(1)
+
+  class Worker(cli.Tool):
+
+    ''' Runs a worker that claims *moment* jobs from a queue and renders
+        them. Run as many as you like, on one host or several. '''
+
+    arguments = (
+      ('--queue', '-Q', {'type': str, 'help': 'path to the job queue to work from (shared queues need working'
+                                        ' file locks - not NFS - and synced clocks)'}),
+      ('--lease', '-L', {'type': int, 'help': 'seconds a claimed job stays leased between heartbeats (default: 60)'}),
+      ('--retries', '-R', {'type': int, 'help': 'attempts a job gets before it is marked failed (default: 3)'}),
+      ('--poll', '-P', {'type': int, 'help': 'seconds to wait between polls of an empty queue (default: 5)'}),
+      ('--once', '-O', {'action': 'store_true', 'help': 'exit when the queue is empty, rather than polling'})
+    )
+
+    def execute(arguments):
+
+      ''' Executes the :py:class:`Moment.Worker` flow, which renders jobs
+          from a queue until interrupted (or until the queue is empty, with
+          ``--once``).
+
+          :param arguments: :py:class:`argparse.Arguments` object indicating
+          desired arguments, as provided by Canteen's :py:class:`cli.Tool` system.
+
+          :returns: Exits directly with Unix-compliant exit code. '''
+
+      try:
+        jobs.Worker(jobs.Queue(arguments.queue, **{
+          'lease': arguments.lease or 60,
+          'retries': arguments.retries or 3
+        })).run(once=arguments.once or False, poll=arguments.poll or 5)
+        return sys.exit(0)
+
+      except KeyboardInterrupt:
+        return sys.exit(0)  # the worker released its job back to the queue
+
+      except Exception:
+
+        if arguments.debug: pdb.set_trace()
+        if not arguments.quiet:
+          traceback.print_exception(*sys.exc_info())
+          logging.critical('Moment worker encountered a fatal error. Exiting.')
+        return sys.exit(1)
+
 
 MomentTool = Moment  # alias to `MomentTool` to preserve "tool name"
@@ -27,23 +27,27 @@ class FFmpeg(base.MomentBase):
   __args__ = None  # positional arguments for this ``FFmpeg`` run
   __input__ = None  # stdin input for target ``FFmpeg`` run
   __kwargs__ = None  # keyword arguments for this ``FFmpeg`` run
-  __output__ = None  # stdout output for target ``FFmpeg`` run
+  __output__ = None  # captured stdout and stderr for target ``FFmpeg`` run
+  __capture__ = False  # whether to capture ``FFmpeg`` output, rather than passing it through
   __target__ = None  # target subprocess containing ``FFmpeg``
   __moment__ = None  # moment job that we'll be working on this run
   __scratch__ = None  # scratch directory where temp files can be written
   __pending__ = False  # flag that indicates we are actively working
 
-  def __init__(self, moment):
+  def __init__(self, moment, capture=False):
 
     ''' Initialize an FFmpeg instance, with arguments/config/options.
         Keyword arguments passed here override values from ``self.config``.
 
         :param moment: :py:class:`Moment` object to compile into a video.
+        :param capture: Capture ``FFmpeg``'s ``stdout`` and ``stderr`` to
+        ``self.output``, instead of passing them through. Defaults to ``False``.
         :returns: Nothing, as this is a constructor. '''
 
-    self.__moment__, self.__args__, self.__kwargs__ = (
+    self.__moment__, self.__args__, self.__kwargs__, self.__capture__ = (
       moment,  # target moment
-      [], {}  # args and kwargs
+      [], {},  # args and kwargs
+      capture  # capture output
     )
 
   ## == Internals == ##
@@ -64,7 +68,9 @@ class FFmpeg(base.MomentBase):
         command,
         shell=False,
         bufsize=0,  # don't buffer from ffmpeg
-        executable=self._ffmpeg_path
+        executable=self._ffmpeg_path,
+        stdout=subprocess.PIPE if self.__capture__ else None,
+        stderr=subprocess.PIPE if self.__capture__ else None
       )
       self.logging.debug('FFmpeg running under native driver at PID %s.' % self.__target__.pid)
     return self.__target__
@@ -226,7 +232,7 @@ class FFmpeg(base.MomentBase):
       self._add_argument(*args, **kwargs)
 
     # stdout and stderr output
-    stdout, stderr = self.target.communicate(self.__input__ or None)
+    self.__output__ = self.target.communicate(self.__input__ or None)
     return self.target.returncode
 
   ## == Property Mappings == ##
@@ -234,5 +240,5 @@ class FFmpeg(base.MomentBase):
   kwargs = property(lambda self: self.__kwargs__)  # kwargs sent to ``FFmpeg``
   target = property(lambda self: self._spawn())  # spawn/grab process
   moment = property(lambda self: self.__moment__)  # subject moment
-  output = property(lambda self: self.__output__)  # output location
+  output = property(lambda self: self.__output__)  # captured ``(stdout, stderr)``
   scratch = property(lambda self: self.__scratch__)  # scratchspace
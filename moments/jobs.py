@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+
+'''
+
+  yapa moments demo: job queue
+
+'''
+
+# stdlib
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import socket
+import sqlite3
+import hashlib
+import threading
+import contextlib
+
+# local
+from . import api, base
+
+
+## Globals
+_LEASE = 60  # seconds a claimed job stays leased to a worker between heartbeats
+_RETRIES = 3  # attempts a job gets before it is marked as failed
+_BACKOFF = 10  # base seconds to wait before retrying a failed attempt (doubles each time)
+_INTERACTIVE = ('debug', 'dry_run', 'quiet', 'verbose')  # options that make no sense for a headless worker
+
+_SCHEMA = '''
+  CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT NOT NULL UNIQUE,
+    source TEXT NOT NULL,
+    target TEXT NOT NULL,
+    options TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    owner TEXT,
+    lease_expires REAL,
+    available_at REAL NOT NULL,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+  )
+'''
+
+
+class Queue(base.MomentBase):
+
+  ''' Durable queue of :py:class:`moments.api.Moment` jobs, backed by an
+      SQLite database. Any number of :py:class:`Worker` processes may share
+      one queue, as long as the filesystem it lives on supports locking.
+
+      Workers on several hosts can share a queue on a network filesystem,
+      with two caveats: SQLite's locking is unreliable over NFS (and some
+      other network filesystems), which can corrupt the queue, and leases
+      are stamped with each host's own clock, so clock skew between hosts
+      can expire a lease early and get a job rendered twice. Keep clocks in
+      sync, and prefer a filesystem with working POSIX locks. '''
+
+  __path__ = None  # path to the SQLite database backing this queue
+  __lease__ = None  # lease duration for claimed jobs, in seconds
+  __retries__ = None  # maximum attempts per job
+
+  def __init__(self, path, lease=_LEASE, retries=_RETRIES):
+
+    ''' Initialize a :py:class:`Queue`, creating its database if needed.
+
+        :param path: Path to the SQLite database backing the queue.
+        :param lease: Seconds a claimed job stays leased without a heartbeat.
+        :param retries: Maximum attempts per job before it is marked failed.
+        :returns: Nothing, as this is a constructor. '''
+
+    self.__path__, self.__lease__, self.__retries__ = (
+      path, lease, retries
+    )
+
+    with self._transaction() as cursor:
+      cursor.execute(_SCHEMA)
+
+  ## == Internals == ##
+  @contextlib.contextmanager
+  def _transaction(self):
+
+    ''' Open a fresh connection and hold a write lock on the queue for
+        the duration of the context. Connections aren't shared, so this
+        is safe across threads and processes.
+
+        :returns: :py:class:`sqlite3.Cursor`, for use in a ``with`` binding. '''
+
+    connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+    try:
+      cursor = connection.cursor()
+      cursor.execute('BEGIN IMMEDIATE')
+      try:
+        yield cursor
+      except:
+        cursor.execute('ROLLBACK')
+        raise
+      else:
+        cursor.execute('COMMIT')
+    finally:
+      connection.close()
+
+  ## == Public == ##
+  def submit(self, source, target, **options):
+
+    ''' Submit a job to render a :py:class:`moments.api.Moment`. Submitting
+        an identical job twice yields the same job, and resubmitting a job
+        that has failed puts it back in line. Interactive options (``debug``,
+        ``dry_run``, ``quiet`` and ``verbose``) are dropped, since workers run
+        headless.
+
+        :param source: Source for the moment (see :py:class:`moments.api.Moment`).
+        :param target: String destination path for the resulting video.
+        :param options: Options for the moment, which must be JSON-serializable.
+        :returns: ``int`` ID of the job. '''
+
+    options = dict((key, value) for key, value in options.iteritems() if key not in _INTERACTIVE)
+    spec = json.dumps([source, target, options], sort_keys=True)
+    key, now = hashlib.sha1(spec.encode('utf-8')).hexdigest(), time.time()
+
+    with self._transaction() as cursor:
+      cursor.execute('INSERT OR IGNORE INTO jobs (key, source, target, options, available_at, created, updated)'
+                     ' VALUES (?, ?, ?, ?, ?, ?, ?)', (
+                       key, json.dumps(source), target, json.dumps(options), now, now, now))
+      cursor.execute("UPDATE jobs SET state = 'pending', attempts = 0, error = NULL, available_at = ?, updated = ?"
+                     " WHERE key = ? AND state = 'failed'", (now, now, key))
+      cursor.execute('SELECT id FROM jobs WHERE key = ?', (key,))
+      return cursor.fetchone()[0]
+
+  def claim(self, owner):
+
+    ''' Claim the next available job, leasing it to ``owner``. Jobs whose
+        lease has expired (because their worker died) are claimed again,
+        unless they are out of attempts, in which case they fail.
+
+        :param owner: String identifying the claiming worker.
+        :returns: ``dict`` describing the claimed job, or ``None`` if there
+        is nothing to do right now. '''
+
+    now = time.time()
+    with self._transaction() as cursor:
+      cursor.execute("UPDATE jobs SET state = 'failed', error = 'lease expired', updated = ?"
+                     " WHERE state = 'running' AND lease_expires < ? AND attempts >= ?", (now, now, self.retries))
+      cursor.execute("SELECT id, source, target, options, attempts FROM jobs"
+                     " WHERE (state = 'pending' AND available_at <= ?)"
+                     " OR (state = 'running' AND lease_expires < ?)"
+                     " ORDER BY id LIMIT 1", (now, now))
+      row = cursor.fetchone()
+      if not row:
+        return None
+
+      cursor.execute("UPDATE jobs SET state = 'running', owner = ?, lease_expires = ?, attempts = attempts + 1,"
+                     " updated = ? WHERE id = ?", (owner, now + self.lease, now, row[0]))
+
+    return {
+      'id': row[0],
+      'source': json.loads(row[1]),
+      'target': row[2],
+      'options': json.loads(row[3]),
+      'attempts': row[4] + 1
+    }
+
+  def heartbeat(self, job, owner):
+
+    ''' Extend the lease on a running job.
+
+        :param job: ``int`` ID of the job.
+        :param owner: String identifying the worker holding the lease.
+        :returns: ``True`` if the lease is still held by ``owner``. '''
+
+    now = time.time()
+    with self._transaction() as cursor:
+      cursor.execute("UPDATE jobs SET lease_expires = ?, updated = ? WHERE id = ? AND owner = ? AND state = 'running'",
+                     (now + self.lease, now, job, owner))
+      return cursor.rowcount == 1
+
+  def complete(self, job, owner):
+
+    ''' Mark a running job as done.
+
+        :param job: ``int`` ID of the job.
+        :param owner: String identifying the worker holding the lease.
+        :returns: ``True`` if the lease was still held by ``owner``. '''
+
+    with self._transaction() as cursor:
+      cursor.execute("UPDATE jobs SET state = 'done', owner = NULL, lease_expires = NULL, error = NULL, updated = ?"
+                     " WHERE id = ? AND owner = ? AND state = 'running'", (time.time(), job, owner))
+      return cursor.rowcount == 1
+
+  def fail(self, job, owner, error):
+
+    ''' Record a failed attempt at a running job. The job is retried after
+        a backoff, or marked as failed once it is out of attempts.
+
+        :param job: ``int`` ID of the job.
+        :param owner: String identifying the worker holding the lease.
+        :param error: String description of what went wrong.
+        :returns: ``True`` if the lease was still held by ``owner``. '''
+
+    now = time.time()
+    with self._transaction() as cursor:
+      cursor.execute("UPDATE jobs SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,"
+                     " available_at = ? + ? * (1 << (attempts - 1)), owner = NULL, lease_expires = NULL,"
+                     " error = ?, updated = ? WHERE id = ? AND owner = ? AND state = 'running'",
+                     (self.retries, now, _BACKOFF, error, now, job, owner))
+      return cursor.rowcount == 1
+
+  def release(self, job, owner):
+
+    ''' Put a running job back in line without counting the attempt, for
+        workers that are shutting down rather than failing.
+
+        :param job: ``int`` ID of the job.
+        :param owner: String identifying the worker holding the lease.
+        :returns: ``True`` if the lease was still held by ``owner``. '''
+
+    now = time.time()
+    with self._transaction() as cursor:
+      cursor.execute("UPDATE jobs SET state = 'pending', attempts = attempts - 1, available_at = ?, owner = NULL,"
+                     " lease_expires = NULL, updated = ? WHERE id = ? AND owner = ? AND state = 'running'",
+                     (now, now, job, owner))
+      return cursor.rowcount == 1
+
+  ## == Property Mappings == ##
+  path = property(lambda self: self.__path__)  # path to queue database
+  lease = property(lambda self: self.__lease__)  # lease duration
+  retries = property(lambda self: self.__retries__)  # max attempts per job
+
+
+class Worker(base.MomentBase):
+
+  ''' Claims jobs from a :py:class:`Queue` and renders them, one at a time,
+      keeping the lease alive with heartbeats while each job runs. Outputs
+      are rendered next to their target and moved into place only on
+      success, so retried jobs are idempotent. '''
+
+  __queue__ = None  # queue this worker claims jobs from
+  __owner__ = None  # unique identity of this worker, for leases
+
+  def __init__(self, queue):
+
+    ''' Initialize a :py:class:`Worker` against a queue.
+
+        :param queue: :py:class:`Queue` to claim jobs from.
+        :returns: Nothing, as this is a constructor. '''
+
+    self.__queue__, self.__owner__ = (
+      queue, '%s:%s:%s' % (socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+    )
+
+  ## == Internals == ##
+  def _heartbeat(self, job, done):
+
+    ''' Keep the lease on ``job`` alive until ``done`` is set. Runs on a
+        background thread while the job renders.
+
+        :param job: ``int`` ID of the job.
+        :param done: :py:class:`threading.Event` set when the job is over.
+        :returns: Nothing. '''
+
+    while not done.wait(self.queue.lease / 3.0):
+      try:
+        held = self.queue.heartbeat(job, self.owner)
+      except sqlite3.Error as e:  # the queue may be busy or briefly unreachable, so try again next tick
+        self.logging.warning('Worker %s failed to heartbeat job %s: %s.' % (self.owner, job, e))
+        continue
+      if not held:
+        self.logging.warning('Worker %s lost its lease on job %s.' % (self.owner, job))
+        return
+
+  def _render(self, job):
+
+    ''' Render a claimed job to a partial file, then move it into place.
+
+        :param job: ``dict`` describing the claimed job.
+        :returns: ``True`` if the job's output is in place. '''
+
+    target = job['target']
+    options = dict((key, value) for key, value in job['options'].iteritems() if key not in _INTERACTIVE)
+    if options.get('safe') and os.path.exists(target):
+      self.logging.info('Output "%s" for job %s already exists.' % (target, job['id']))
+      return True
+
+    root, extension = os.path.splitext(target)
+    partial = '%s.part-%s%s' % (root, self.owner.replace(':', '-'), extension)
+
+    moment = api.Moment(job['source'], partial, **options)
+    try:
+      if not moment(None, sys.stdout, sys.stderr):
+        return False
+      os.rename(partial, target)  # atomic, so readers never see a half-written video
+      return True
+    finally:
+      if os.path.exists(partial):
+        os.remove(partial)
+      if moment.driver.scratch:  # the driver leaves frames behind, which adds up over many jobs
+        shutil.rmtree(moment.driver.scratch, ignore_errors=True)
+
+  ## == Public == ##
+  def run(self, once=False, poll=5):
+
+    ''' Claim and render jobs until interrupted. If interrupted mid-job,
+        the job is released back to the queue before the interrupt is
+        re-raised, so it doesn't cost an attempt.
+
+        :param once: Exit once there are no jobs available, rather than polling.
+        :param poll: Seconds to wait between polls while the queue is empty.
+        :returns: ``int`` number of jobs that were rendered successfully. '''
+
+    rendered = 0
+    while True:
+      job = self.queue.claim(self.owner)
+      if job is None:
+        if once:
+          return rendered
+        time.sleep(poll)
+        continue
+
+      self.logging.info('Worker %s claimed job %s (attempt %s).' % (self.owner, job['id'], job['attempts']))
+      done = threading.Event()
+      heartbeat = threading.Thread(target=self._heartbeat, args=(job['id'], done))
+      heartbeat.daemon = True
+      heartbeat.start()
+
+      try:
+        try:
+          succeeded, error = self._render(job), 'render failed'
+        except Exception as e:
+          self.logging.exception('Worker %s encountered an error rendering job %s.' % (self.owner, job['id']))
+          succeeded, error = False, '%s: %s' % (e.__class__.__name__, e)
+        finally:
+          done.set()
+          heartbeat.join()
+      except KeyboardInterrupt:
+        self.logging.info('Worker %s interrupted, releasing job %s.' % (self.owner, job['id']))
+        self.queue.release(job['id'], self.owner)
+        raise
+
+      if succeeded:
+        rendered += 1
+        held = self.queue.complete(job['id'], self.owner)
+      else:
+        held = self.queue.fail(job['id'], self.owner, error)
+
+      if not held:  # another worker reclaimed it meanwhile, and its outcome stands
+        self.logging.warning('Worker %s lost its lease on job %s before recording its outcome.' % (
+          self.owner, job['id']))
+
+  ## == Property Mappings == ##
+  queue = property(lambda self: self.__queue__)  # job queue
+  owner = property(lambda self: self.__owner__)  # worker identity
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+
+'''
+
+  yapa moments demo: cost model
+
+'''
+
+# stdlib
+import os
+import json
+import time
+import errno
+import fcntl
+import tempfile
+
+# local
+from . import base
+
+
+## Globals
+_HISTORY_PATH = os.path.join('~', '.moments', 'history.json')  # default run history location
+_HISTORY_LIMIT = 200  # maximum number of past runs to keep around for calibration
+
+_MODEL = (  # (measured quantity, feature it scales with, default coefficient)
+  ('fetch_wall', 'remote', 0.1),  # seconds per image fetched over HTTP or read out of an archive
+  ('fetch_cpu', 'remote', 0.01),  # CPU seconds per image fetched or unpacked
+  ('resize_wall', 'resize', 0.05),  # seconds per megapixel decoded + written
+  ('resize_cpu', 'resize', 0.05),  # CPU seconds per megapixel decoded + written
+  ('encode_wall', 'encode', 0.02),  # seconds per frame-megapixel encoded
+  ('encode_cpu', 'encode', 0.04),  # CPU seconds per frame-megapixel encoded
+  ('scratch_bytes', 'scratch', 150000.0),  # scratch bytes per frame-megapixel
+  ('output_bytes', 'output', 1.0),  # output bytes per nominal (bitrate-derived) byte
+  ('output_bytes', 'pictures', 200000.0)  # output bytes per new-picture megapixel, at constant quality
+)
+
+
+def parse_bitrate(bitrate):
+
+  ''' Parse an ``FFmpeg``-style bitrate string (like ``5000k`` or ``2M``)
+      into a number of bits per second.
+
+      :param bitrate: Bitrate string or number.
+      :returns: Integer bits per second, or ``None`` if unparseable. '''
+
+  try:
+    value = str(bitrate).strip().lower()
+    scale = {'k': 1000, 'm': 1000000}.get(value[-1:], 1)
+    return int(float(value[:-1] if scale != 1 else value) * scale)
+  except (TypeError, ValueError):
+    return None
+
+
+def features(plan):
+
+  ''' Reduce a run plan (as produced by :py:meth:`moments.api.Moment.plan`)
+      into the units of work each stage of the cost model scales with.
+
+      :param plan: ``dict`` run plan.
+      :returns: ``dict`` of feature name to amount of work. '''
+
+  frame_mpx = plan['frames'] * plan['size'][0] * plan['size'][1] / 1e6
+  bitrate = parse_bitrate(plan.get('bitrate'))
+
+  return {
+    'remote': plan.get('remote', 0),
+    'resize': plan['source_pixels'] / 1e6 + frame_mpx,
+    'encode': frame_mpx,
+    'scratch': frame_mpx,
+    'output': (bitrate * plan['length'] / 8.0) if bitrate else None,
+    # at constant quality (``auto`` or CRF), size follows the new pictures, not the repeats
+    'pictures': (plan['images'] * plan['size'][0] * plan['size'][1] / 1e6) if not bitrate else None
+  }
+
+
+class CostModel(base.MomentBase):
+
+  ''' Predicts stage timings and sizes for a :py:class:`moments.api.Moment`
+      run, calibrated from runs previously recorded on this host. '''
+
+  __path__ = None  # path to the JSON run history backing this model
+
+  def __init__(self, path=None):
+
+    ''' Initialize a :py:class:`CostModel` against a run history file.
+
+        :param path: Path to the run history. Defaults to ``~/.moments/history.json``.
+        :returns: Nothing, as this is a constructor. '''
+
+    self.__path__ = os.path.expanduser(path or _HISTORY_PATH)
+
+  ## == Internals == ##
+  def _coefficients(self, history):
+
+    ''' Calibrate per-unit coefficients for each modelled quantity, as the
+        ratio of total measured cost to total work across ``history``.
+
+        :param history: ``list`` of recorded runs.
+        :returns: ``dict`` of ``(quantity, feature)`` to coefficient. '''
+
+    coefficients = {}
+    for quantity, feature, default in _MODEL:
+      measured, work = 0.0, 0.0
+      for run in history:
+        if quantity in run.get('measured', {}) and run.get('features', {}).get(feature):
+          measured += run['measured'][quantity]
+          work += run['features'][feature]
+      coefficients[(quantity, feature)] = (measured / work) if work else default
+    return coefficients
+
+  ## == Public == ##
+  def load(self):
+
+    ''' Load recorded runs from the history file, if there is one.
+
+        :returns: ``list`` of recorded runs, oldest first. '''
+
+    try:
+      with open(self.path, 'r') as history:
+        return json.load(history)
+    except IOError as e:
+      if e.errno != errno.ENOENT:
+        raise
+    except ValueError:
+      self.logging.warning('Ignoring corrupt run history at "%s".' % self.path)
+    return []
+
+  def record(self, plan, measured, encoder=None):
+
+    ''' Record a finished run so future estimates can be calibrated
+        against it. The history is replaced atomically, under an exclusive
+        lock, so concurrent runs on one host don't drop each other's entries.
+
+        :param plan: ``dict`` run plan the run was executed against.
+        :param measured: ``dict`` of measured quantity name to value.
+        :param encoder: ``dict`` of encoder settings chosen for ``auto``
+        bitrate, with the frame complexity they were chosen for, if any.
+        :returns: ``self``, for easy chainability. '''
+
+    directory = os.path.dirname(self.path)
+    try:
+      os.makedirs(directory)
+    except OSError as e:
+      if e.errno != errno.EEXIST:
+        raise
+
+    with open(self.path + '.lock', 'a') as lock:
+      fcntl.flock(lock, fcntl.LOCK_EX)  # released when ``lock`` closes
+
+      history = self.load() + [{
+        'when': time.time(),
+        'features': features(plan),
+        'measured': measured,
+        'encoder': encoder
+      }]
+
+      handle, scratch = tempfile.mkstemp(dir=directory)
+      with os.fdopen(handle, 'w') as out:
+        json.dump(history[-_HISTORY_LIMIT:], out)
+      os.rename(scratch, self.path)
+    return self
+
+  def estimate(self, plan):
+
+    ''' Predict stage timings and sizes for a run plan.
+
+        :param plan: ``dict`` run plan.
+        :returns: ``dict`` of predicted quantities, plus the number of
+        recorded runs they were calibrated from. '''
+
+    history = self.load()
+    work, coefficients = features(plan), self._coefficients(history)
+
+    estimate = {}
+    for quantity, feature, _ in _MODEL:  # first feature that applies to this plan wins
+      if estimate.get(quantity) is None:
+        estimate[quantity] = (coefficients[(quantity, feature)] * work[feature]) if work[feature] is not None else None
+    estimate['cpu_seconds'] = estimate['fetch_cpu'] + estimate['resize_cpu'] + estimate['encode_cpu']
+    estimate['calibrated_from'] = len(history)
+    return estimate
+
+  ## == Property Mappings == ##
+  path = property(lambda self: self.__path__)  # path to run history
@@ -0,0 +1,369 @@
+# -*- coding: utf-8 -*-
+
+'''
+
+  yapa moments demo: image sources
+
+'''
+
+# stdlib
+import io
+import glob
+import time
+import Queue
+import socket
+import fnmatch
+import httplib
+import tarfile
+import zipfile
+import urlparse
+import threading
+
+# local
+from . import base
+
+
+## Globals
+_CONCURRENCY = 8  # default maximum concurrent fetches, across all hosts
+_PER_HOST = 4  # maximum concurrent fetches against any one host
+_RETRIES = 3  # attempts per fetch before giving up
+_BACKOFF = 0.5  # base seconds to wait between fetch attempts (doubles each time)
+_TIMEOUT = 30  # socket timeout for fetches, in seconds
+_PROBE_BYTES = 65536  # bytes to request when probing a remote image's header
+_ARCHIVES = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2')  # archive types we read members from
+_MEMBER = '!'  # separates an archive path from the glob (or name) of members inside it
+
+
+def _split_archive(spec):
+
+  ''' Split a source spec or item like ``album.tar.gz!*.jpg`` into its
+      archive path and inner member glob. A bare archive path selects
+      every member.
+
+      :param spec: Source spec or item string.
+      :returns: ``(archive, inner)`` tuple, or ``None`` if ``spec`` doesn't
+      refer to an archive. '''
+
+  archive, _, inner = spec.partition(_MEMBER)
+  if not archive.lower().endswith(_ARCHIVES):
+    return None
+  return archive, inner or '*'
+
+
+def _unpack(archive, members, probe=False):
+
+  ''' Read members out of an archive in memory, in the order they're
+      stored. Tarballs have no index, so they're read with one sequential
+      streaming pass here, on top of the one :py:func:`_list` makes during
+      discovery.
+
+      :param archive: Path to a zip or tar archive.
+      :param members: ``set`` of member names to read.
+      :param probe: Only read enough of each member to read its header.
+      :returns: Generator of ``(member, data)`` pairs, one per stored copy
+      of each member. '''
+
+  size = _PROBE_BYTES if probe else None
+
+  if zipfile.is_zipfile(archive):
+    with zipfile.ZipFile(archive) as bundle:
+      for info in bundle.infolist():  # opened by entry, since names may repeat
+        if info.filename in members:
+          yield info.filename, bundle.open(info).read(size)
+    return
+
+  with tarfile.open(archive, 'r|*') as bundle:
+    for member in bundle:
+      if member.name in members:
+        yield member.name, bundle.extractfile(member).read(size)
+
+
+def _list(archive):
+
+  ''' List the regular file members of an archive, in stored order. For
+      tarballs, this means one sequential pass through the whole archive.
+
+      :param archive: Path to a zip or tar archive.
+      :returns: ``list`` of member names. '''
+
+  if zipfile.is_zipfile(archive):
+    with zipfile.ZipFile(archive) as bundle:
+      return [member.filename for member in bundle.infolist() if not member.filename.endswith('/')]
+
+  with tarfile.open(archive, 'r|*') as bundle:
+    return [member.name for member in bundle if member.isfile()]
+
+
+def is_url(item):
+
+  ''' Decide whether a source item is a remote (HTTP or HTTPS) URL.
+
+      :param item: Source item string.
+      :returns: ``True`` if ``item`` should be fetched over HTTP. '''
+
+  return item.startswith(('http://', 'https://'))
+
+
+def is_remote(item):
+
+  ''' Decide whether a source item has to be fetched or unpacked before it
+      can be decoded, rather than just opened on local disk.
+
+      :param item: Source item string.
+      :returns: ``True`` if ``item`` is a URL or an archive member. '''
+
+  return is_url(item) or bool(_split_archive(item))
+
+
+def discover(source):
+
+  ''' Expand a source specification into individual source items. Local
+      globs are expanded, archive member globs (``album.zip!*.jpg``) are
+      matched against the listing of each archive matching the archive
+      part (which may be a glob too, like ``uploads/*.zip!*.jpg``), and URLs
+      are passed through untouched. Archives that can't be read are logged
+      and skipped.
+
+      :param source: Glob, URL, archive, or a ``list`` of any of them.
+      :returns: ``list`` of source item strings, in order. Archive members
+      are named ``archive!member``. '''
+
+  items = []
+  for spec in ([source] if isinstance(source, basestring) else source):
+    if is_url(spec):
+      items.append(spec)
+    elif _split_archive(spec):
+      pattern, inner = _split_archive(spec)
+      for archive in (glob.iglob(pattern) if glob.has_magic(pattern) else (pattern,)):
+        try:
+          members = _list(archive)
+        except (IOError, OSError, tarfile.TarError, zipfile.BadZipfile) as e:
+          base._LOGGER.error('Failed to list source archive "%s": %s.' % (archive, e))
+          continue
+        items.extend(_MEMBER.join((archive, member)) for member in members if fnmatch.fnmatch(member, inner))
+    else:
+      items.extend(glob.iglob(spec))
+  return items
+
+
+def stream(items, concurrency=None, probe=False):
+
+  ''' Open a set of discovered source items for decoding. Local files are
+      opened directly, archive members are read into memory straight out of
+      their archive (never unpacked to disk), and URLs are fetched
+      concurrently through a :py:class:`Pool` and handed over as each one
+      arrives, so decoding overlaps with downloading.
+
+      :param items: ``list`` of ``(image_i, item)`` pairs.
+      :param concurrency: Maximum concurrent fetches. Defaults to ``8``.
+      :param probe: Only fetch enough of each remote image to read its header.
+
+      :returns: Generator of ``(image_i, item, handle)`` triples, where
+      ``handle`` is a readable file-like object, or ``None`` if the item
+      could not be opened. Archive members come in stored order, and
+      remote items in order of arrival. '''
+
+  remote = [(image_i, item) for image_i, item in items if is_url(item)]
+  archived = {}  # archive path => {member name => [(image_i, item), ...] in stored order}
+  pool = Pool(concurrency or _CONCURRENCY)
+
+  try:
+    arrivals = pool.map(remote, probe=probe)  # start fetching before touching local files
+
+    for image_i, item in items:
+      if is_url(item):
+        continue
+      elif _split_archive(item):
+        archive, member = _split_archive(item)
+        archived.setdefault(archive, {}).setdefault(member, []).append((image_i, item))
+      else:
+        try:
+          yield image_i, item, open(item, 'rb')
+        except (IOError, OSError):
+          yield image_i, item, None
+
+    for archive, members in archived.iteritems():
+      try:
+        for member, data in _unpack(archive, set(members), probe=probe):
+          if members.get(member):  # tarballs may hold several copies of a member, matched in order
+            image_i, item = members[member].pop(0)
+            yield image_i, item, io.BytesIO(data)
+      except (IOError, OSError, tarfile.TarError, zipfile.BadZipfile) as e:
+        pool.logging.error('Failed to read source archive "%s": %s.' % (archive, e))
+      for image_i, item in sum(members.values(), []):  # anything we couldn't read
+        yield image_i, item, None
+
+    for _ in remote:
+      image_i, item, data = arrivals.get()
+      yield image_i, item, (io.BytesIO(data) if data is not None else None)
+
+  finally:
+    pool.close()
+
+
+class Pool(base.MomentBase):
+
+  ''' Concurrency-limited HTTP client that keeps connections alive and
+      reuses them across fetches, with per-host limits and retries. '''
+
+  __idle__ = None  # idle keep-alive connections, by ``(scheme, netloc)``
+  __hosts__ = None  # semaphores limiting concurrent fetches per host
+  __lock__ = None  # guards ``__idle__`` and ``__hosts__``
+  __closed__ = False  # set once the pool is shut down
+  __concurrency__ = None  # maximum concurrent fetches, across all hosts
+
+  def __init__(self, concurrency=_CONCURRENCY):
+
+    ''' Initialize an empty :py:class:`Pool`.
+
+        :param concurrency: Maximum concurrent fetches, across all hosts.
+        :returns: Nothing, as this is a constructor. '''
+
+    self.__idle__, self.__hosts__, self.__lock__, self.__concurrency__ = (
+      {}, {}, threading.Lock(), concurrency
+    )
+
+  ## == Internals == ##
+  def _checkout(self, key):
+
+    ''' Take an idle connection for ``key`` from the pool, or make one.
+
+        :param key: ``(scheme, netloc)`` tuple.
+        :returns: :py:class:`httplib.HTTPConnection` (or HTTPS). '''
+
+    with self.__lock__:
+      if self.__idle__.get(key):
+        return self.__idle__[key].pop()
+    factory = httplib.HTTPSConnection if key[0] == 'https' else httplib.HTTPConnection
+    return factory(key[1], timeout=_TIMEOUT)
+
+  def _checkin(self, key, connection):
+
+    ''' Return a connection to the pool, for reuse by later fetches.
+
+        :param key: ``(scheme, netloc)`` tuple.
+        :param connection: Connection to return.
+        :returns: Nothing. '''
+
+    with self.__lock__:
+      if not self.__closed__:
+        self.__idle__.setdefault(key, []).append(connection)
+        return
+    connection.close()
+
+  def _host(self, key):
+
+    ''' Fetch the semaphore limiting concurrent fetches against a host.
+
+        :param key: ``(scheme, netloc)`` tuple.
+        :returns: :py:class:`threading.BoundedSemaphore`. '''
+
+    with self.__lock__:
+      return self.__hosts__.setdefault(key, threading.BoundedSemaphore(_PER_HOST))
+
+  def _work(self, pending, arrivals, probe):
+
+    ''' Worker thread body: fetch items from ``pending`` until it's empty,
+        posting each result to ``arrivals``.
+
+        :param pending: :py:class:`Queue.Queue` of ``(image_i, item)`` pairs.
+        :param arrivals: :py:class:`Queue.Queue` to post results to.
+        :param probe: Only fetch image headers.
+        :returns: Nothing. '''
+
+    while not self.__closed__:
+      try:
+        image_i, item = pending.get_nowait()
+      except Queue.Empty:
+        return
+
+      data = None
+      try:
+        data = self.fetch(item, probe=probe)
+      except Exception as e:  # anything (even a malformed URL) must still post, or ``stream`` waits forever
+        self.logging.error('Failed to fetch source image "%s": %s.' % (item, e))
+      finally:
+        arrivals.put((image_i, item, data))
+
+  ## == Public == ##
+  def fetch(self, url, probe=False):
+
+    ''' Fetch the body at ``url`` over a pooled connection, retrying on
+        connection errors and server errors.
+
+        :param url: HTTP or HTTPS URL to fetch.
+        :param probe: Only request the first bytes of the body.
+        :raises IOError: If the fetch fails after all retries, or the
+        server rejects the request outright.
+        :returns: ``str`` body bytes. '''
+
+    parsed = urlparse.urlsplit(url)
+    key = (parsed.scheme, parsed.netloc)
+    path = (parsed.path or '/') + (('?' + parsed.query) if parsed.query else '')
+    headers = {'Range': 'bytes=0-%s' % (_PROBE_BYTES - 1)} if probe else {}
+
+    for attempt in xrange(_RETRIES):
+      if attempt:
+        time.sleep(_BACKOFF * (2 ** (attempt - 1)))
+
+      with self._host(key):
+        connection = self._checkout(key)
+        try:
+          connection.request('GET', path, headers=headers)
+          response = connection.getresponse()
+          body = response.read()
+        except (socket.error, httplib.HTTPException) as e:
+          connection.close()  # don't reuse a broken connection
+          error = e
+          continue
+
+        if response.will_close:
+          connection.close()
+        else:
+          self._checkin(key, connection)
+
+      if response.status in (200, 206):
+        return body
+      error = IOError('HTTP %s fetching "%s"' % (response.status, url))
+      if response.status < 500:
+        raise error  # client errors won't get better with retries
+
+    raise IOError('Gave up fetching "%s" after %s attempts: %s' % (url, _RETRIES, error))
+
+  def map(self, items, probe=False):
+
+    ''' Fetch a set of items concurrently, in the background.
+
+        :param items: ``list`` of ``(image_i, url)`` pairs.
+        :param probe: Only fetch image headers.
+        :returns: :py:class:`Queue.Queue` that receives an ``(image_i, url,
+        data)`` triple for each item as it arrives, where ``data`` is
+        ``None`` if the fetch failed. '''
+
+    pending, arrivals = Queue.Queue(), Queue.Queue()
+    for item in items:
+      pending.put(item)
+
+    for _ in xrange(min(self.concurrency, len(items))):
+      worker = threading.Thread(target=self._work, args=(pending, arrivals, probe))
+      worker.daemon = True
+      worker.start()
+    return arrivals
+
+  def close(self):
+
+    ''' Shut down the pool: stop workers picking up new fetches, and close
+        all idle connections.
+
+        :returns: Nothing. '''
+
+    with self.__lock__:
+      self.__closed__ = True
+      idle, self.__idle__ = self.__idle__, {}
+
+    for connections in idle.values():
+      for connection in connections:
+        connection.close()
+
+  ## == Property Mappings == ##
+  concurrency = property(lambda self: self.__concurrency__)  # max concurrent fetches
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+'''
+
+  yapa moments demo: API tests
+
+'''
+
+# stdlib
+import random
+import unittest
+
+# imaging
+from PIL import Image
+
+# local
+from moments import api
+
+
+def _moment(**options):
+
+  ''' Build a :py:class:`moments.api.Moment` with ``auto`` bitrate and the
+      given frame complexities already recorded, as if frames had been
+      rendered. '''
+
+  complexity = options.pop('complexity', [0.05, 0.1])
+  moment = api.Moment('/album/*.jpg', '/out.mp4', **dict({'bitrate': 'auto', 'crf': None, 'quality': 23}, **options))
+  moment.stats['complexity'] = complexity
+  return moment
+
+
+class ComplexityTests(unittest.TestCase):
+
+  ''' Tests :py:func:`moments.api._complexity`. '''
+
+  def test_flat_vs_noisy(self):
+
+    ''' Flat frames score zero, noisy ones score far higher. '''
+
+    flat = Image.new('RGB', (64, 64), (128, 128, 128))
+    noisy = Image.new('L', (64, 64))
+    generator = random.Random(0)
+    noisy.putdata([generator.randint(0, 255) for _ in xrange(64 * 64)])
+
+    self.assertEqual(api._complexity(flat), 0.0)
+    self.assertGreater(api._complexity(noisy), 0.5)
+
+
+class SelectRateTests(unittest.TestCase):
+
+  ''' Tests :py:meth:`moments.api.Moment._select_rate`. '''
+
+  def test_quality(self):
+
+    ''' ``auto`` encodes at the ``quality`` CRF, with no bitrate. '''
+
+    encoder = _moment(quality=20)._select_rate()
+    self.assertEqual((encoder['crf'], encoder['bitrate']), (20, None))
+    self.assertAlmostEqual(encoder['complexity']['mean'], 0.075)
+
+  def test_quality_zero(self):
+
+    ''' A ``quality`` of zero (lossless) is honoured, not replaced by the default. '''
+
+    self.assertEqual(_moment(quality=0)._select_rate()['crf'], 0)
+    self.assertEqual(_moment(quality=None)._select_rate()['crf'], api._QUALITY)
+
+  def test_explicit_crf(self):
+
+    ''' An explicit ``crf`` wins over ``quality``. '''
+
+    moment = _moment(crf=30, quality=18)
+    self.assertEqual(moment._select_rate()['crf'], 30)
+    self.assertEqual(moment.stats['encoder']['crf'], 30)
+
+  def test_clamp(self):
+
+    ''' The CRF is clamped to x264's range. '''
+
+    self.assertEqual(_moment(quality=80)._select_rate()['crf'], 51)
+    self.assertEqual(_moment(crf=-5)._select_rate()['crf'], 0)
+
+  def test_no_frames(self):
+
+    ''' With no rendered frames, there's no complexity to record. '''
+
+    self.assertIsNone(_moment(complexity=[])._select_rate()['complexity'])
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+'''
+
+  yapa moments demo: encoder benchmark tests
+
+'''
+
+# stdlib
+import unittest
+
+# local
+from moments import bench
+
+
+## Globals
+_SSIM_LINE = '[Parsed_ssim_0 @ 0x7f8c1c0] SSIM Y:0.990000 (20.000000) U:0.995 (23.01) V:0.996 (23.98) All:0.987654 (19.08)'
+_PSNR_LINE = '[Parsed_psnr_1 @ 0x7f8c1d0] PSNR y:44.10 u:45.00 v:46.00 average:44.732100 min:41.20 max:49.90'
+_PSNR_INF = '[Parsed_psnr_1 @ 0x7f8c1d0] PSNR y:inf u:inf v:inf average:inf min:inf max:inf'
+
+
+class _FFmpeg(object):
+
+  ''' Stands in for :py:class:`moments.driver.FFmpeg`, replaying canned
+      ``stderr`` output. '''
+
+  stderr, returncode = '', 0
+
+  def __init__(self, moment, capture=False):
+
+    ''' Accept the same arguments as the real driver. '''
+
+  def __call__(self, *args):
+
+    ''' Pretend to run ``FFmpeg``. '''
+
+    return self.returncode
+
+  output = property(lambda self: ('', self.stderr))
+
+
+class _Moment(object):
+
+  ''' Stands in for :py:class:`moments.api.Moment`, with nothing to render. '''
+
+  driver = property(lambda self: self)
+
+  def __init__(self, source, target, **options):
+
+    ''' Accept the same arguments as the real moment. '''
+
+  def __enter__(self):
+
+    ''' Pretend to acquire the driver. '''
+
+    return self
+
+  def __exit__(self, *exc_info):
+
+    ''' Pretend to release the driver. '''
+
+  def _validate_input(self):
+
+    ''' Pretend to render frames. '''
+
+    return self
+
+
+class BenchmarkTests(unittest.TestCase):
+
+  ''' Tests the benchmark matrix, Pareto front and score parsing. '''
+
+  def setUp(self):
+
+    ''' Replay canned ``FFmpeg`` output instead of running it. '''
+
+    self.ffmpeg, bench.driver.FFmpeg = bench.driver.FFmpeg, _FFmpeg
+
+  def tearDown(self):
+
+    ''' Restore the real driver. '''
+
+    bench.driver.FFmpeg, _FFmpeg.stderr = self.ffmpeg, ''
+
+  def test_matrix(self):
+
+    ''' The matrix is the baseline plus every combination of settings. '''
+
+    settings = bench.matrix(presets=('fast', 'slow'), crfs=(18, 23), tunes=(None,))
+    self.assertEqual(len(settings), 5)
+    self.assertEqual(settings[0], bench._BASELINE)
+    self.assertIsNot(settings[0], bench._BASELINE)
+    self.assertIn({'preset': 'slow', 'crf': 23, 'tune': None, 'bitrate': None}, settings)
+    self.assertEqual(len(bench.matrix()), 1 + len(bench._PRESETS) * len(bench._CRFS) * len(bench._TUNES))
+
+  def test_dominates(self):
+
+    ''' Only results at least as good on every axis, and better on one, dominate. '''
+
+    base = {'encode_cpu': 2.0, 'bytes': 1000, 'ssim': 0.98}
+    self.assertTrue(bench._dominates(dict(base, encode_cpu=1.0), base))
+    self.assertTrue(bench._dominates(dict(base, ssim=0.99), base))
+    self.assertFalse(bench._dominates(base, base))
+    self.assertFalse(bench._dominates(dict(base, encode_cpu=1.0, bytes=2000), base))  # a trade-off
+
+  def test_score_patterns(self):
+
+    ''' SSIM and PSNR are read from ``FFmpeg``'s filter summaries. '''
+
+    self.assertEqual(bench._SSIM.search(_SSIM_LINE).group(1), '0.987654')
+    self.assertEqual(bench._PSNR.search(_PSNR_LINE).group(1), '44.732100')
+    self.assertEqual(bench._PSNR.search(_PSNR_INF).group(1), 'inf')
+    self.assertIsNone(bench._SSIM.search(_PSNR_LINE))
+
+  def test_score(self):
+
+    ''' Scores parse from ``stderr``, and infinite PSNR becomes ``None``. '''
+
+    benchmark = bench.Benchmark('/album/*.jpg')
+
+    _FFmpeg.stderr = '\n'.join(('frame=  360 fps=0.0 q=-0.0 Lsize=N/A', _SSIM_LINE, _PSNR_LINE))
+    self.assertEqual(benchmark._score(None, 'a.mp4', 'b.mp4'), {'ssim': 0.987654, 'psnr': 44.7321})
+
+    _FFmpeg.stderr = '\n'.join((_SSIM_LINE, _PSNR_INF))
+    self.assertIsNone(benchmark._score(None, 'a.mp4', 'b.mp4')['psnr'])
+
+    _FFmpeg.stderr = 'Conversion failed!'
+    self.assertRaises(RuntimeError, benchmark._score, None, 'a.mp4', 'b.mp4')
+
+  def test_run_survives_failures(self):
+
+    ''' A failing setting is recorded and skipped, not fatal. '''
+
+    def _encode(moment, target, **settings):
+      if settings['crf'] == 23:
+        raise RuntimeError('FFmpeg failed to encode benchmark settings %s.' % settings)
+      return {'encode_wall': 1.0, 'encode_cpu': float(settings['crf'] or 0), 'bytes': 1000}
+
+    benchmark = bench.Benchmark('/album/*.jpg', settings=bench.matrix(presets=('fast',), crfs=(18, 23), tunes=(None,)))
+    benchmark._encode, benchmark._score = _encode, lambda moment, target, reference: {'ssim': 0.98, 'psnr': None}
+
+    moment, bench.api.Moment = bench.api.Moment, _Moment
+    try:
+      results = benchmark.run()
+    finally:
+      bench.api.Moment = moment
+
+    self.assertEqual([result['crf'] for result in results], [None, 18, 23])
+    self.assertIn('error', results[-1])
+    self.assertEqual([result['pareto'] for result in results], [True, False, False])
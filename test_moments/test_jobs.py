@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+
+'''
+
+  yapa moments demo: job queue tests
+
+'''
+
+# stdlib
+import os
+import time
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+# local
+from moments import jobs
+
+
+class QueueTests(unittest.TestCase):
+
+  ''' Tests :py:class:`moments.jobs.Queue` leasing, retries and dedupe. '''
+
+  def setUp(self):
+
+    ''' Create a fresh queue in a scratch directory. '''
+
+    self.workdir = tempfile.mkdtemp()
+    self.path = os.path.join(self.workdir, 'queue.db')
+    self.queue = jobs.Queue(self.path, lease=60, retries=2)
+
+  def tearDown(self):
+
+    ''' Remove the scratch directory. '''
+
+    shutil.rmtree(self.workdir, ignore_errors=True)
+
+  def _row(self, job):
+
+    ''' Fetch the raw ``(state, attempts, available_at)`` of a job. '''
+
+    connection = sqlite3.connect(self.path)
+    try:
+      return connection.execute('SELECT state, attempts, available_at FROM jobs WHERE id = ?', (job,)).fetchone()
+    finally:
+      connection.close()
+
+  def test_submit_dedupe(self):
+
+    ''' Identical submissions yield one job, ignoring interactive options. '''
+
+    first = self.queue.submit('/album/*.jpg', '/out.mp4', size=300, debug=True)
+    second = self.queue.submit('/album/*.jpg', '/out.mp4', size=300, verbose=True)
+    other = self.queue.submit('/album/*.jpg', '/out.mp4', size=500)
+
+    self.assertEqual(first, second)
+    self.assertNotEqual(first, other)
+    self.assertEqual(self.queue.claim('worker')['options'], {'size': 300})
+
+  def test_reclaim_expired_lease(self):
+
+    ''' A job whose lease expires is claimed again by another worker. '''
+
+    queue = jobs.Queue(self.path, lease=0.1, retries=2)
+    job = queue.submit('/album/*.jpg', '/out.mp4')
+
+    self.assertEqual(queue.claim('dead')['id'], job)
+    self.assertIsNone(queue.claim('alive'))
+    time.sleep(0.2)
+
+    reclaimed = queue.claim('alive')
+    self.assertEqual(reclaimed['id'], job)
+    self.assertEqual(reclaimed['attempts'], 2)
+
+  def test_stale_owner_complete(self):
+
+    ''' Only the worker currently holding the lease can complete a job. '''
+
+    queue = jobs.Queue(self.path, lease=0.1, retries=2)
+    job = queue.submit('/album/*.jpg', '/out.mp4')
+    queue.claim('stale')
+    time.sleep(0.2)
+    queue.claim('fresh')
+
+    self.assertFalse(queue.complete(job, 'stale'))
+    self.assertFalse(queue.heartbeat(job, 'stale'))
+    self.assertTrue(queue.complete(job, 'fresh'))
+    self.assertEqual(self._row(job)[0], 'done')
+
+  def test_backoff_then_failure(self):
+
+    ''' Failed attempts back off, then fail once attempts run out. '''
+
+    job = self.queue.submit('/album/*.jpg', '/out.mp4')
+
+    self.queue.claim('worker')
+    before = time.time()
+    self.assertTrue(self.queue.fail(job, 'worker', 'boom'))
+
+    state, attempts, available_at = self._row(job)
+    self.assertEqual((state, attempts), ('pending', 1))
+    self.assertGreaterEqual(available_at, before + jobs._BACKOFF)
+    self.assertIsNone(self.queue.claim('worker'))  # still backing off
+
+    connection = sqlite3.connect(self.path)
+    connection.execute('UPDATE jobs SET available_at = 0')
+    connection.commit()
+    connection.close()
+
+    self.queue.claim('worker')
+    self.assertTrue(self.queue.fail(job, 'worker', 'boom'))
+    self.assertEqual(self._row(job)[:2], ('failed', 2))
+    self.assertIsNone(self.queue.claim('worker'))
+
+    # resubmitting a failed job puts it back in line
+    self.assertEqual(self.queue.submit('/album/*.jpg', '/out.mp4'), job)
+    self.assertEqual(self._row(job)[:2], ('pending', 0))
+
+  def test_release(self):
+
+    ''' Releasing a job puts it straight back in line, without using up an attempt. '''
+
+    job = self.queue.submit('/album/*.jpg', '/out.mp4')
+    self.queue.claim('worker')
+
+    self.assertFalse(self.queue.release(job, 'other'))
+    self.assertTrue(self.queue.release(job, 'worker'))
+    self.assertEqual(self._row(job)[:2], ('pending', 0))
+
+    claimed = self.queue.claim('worker')
+    self.assertEqual((claimed['id'], claimed['attempts']), (job, 1))
+
+
+class _FlakyQueue(object):
+
+  ''' Stands in for a :py:class:`moments.jobs.Queue` whose database is
+      locked for the first few heartbeats. '''
+
+  lease = 0.03
+
+  def __init__(self, failures):
+
+    ''' Fail the first ``failures`` heartbeats. '''
+
+    self.failures, self.beats = failures, 0
+
+  def heartbeat(self, job, owner):
+
+    ''' Count the heartbeat, failing while there are failures left. '''
+
+    self.beats += 1
+    if self.beats <= self.failures:
+      raise sqlite3.OperationalError('database is locked')
+    return False  # lease lost, which ends the heartbeat thread
+
+
+class WorkerTests(unittest.TestCase):
+
+  ''' Tests :py:class:`moments.jobs.Worker` lease handling. '''
+
+  def test_heartbeat_survives_errors(self):
+
+    ''' A heartbeat that errors is retried on the next tick. '''
+
+    queue = _FlakyQueue(failures=2)
+    heartbeat = threading.Thread(target=jobs.Worker(queue)._heartbeat, args=(1, threading.Event()))
+    heartbeat.daemon = True
+    heartbeat.start()
+    heartbeat.join(5)
+
+    self.assertFalse(heartbeat.is_alive())
+    self.assertEqual(queue.beats, 3)
+
+  def test_interrupt_releases_job(self):
+
+    ''' Interrupting a worker mid-job releases the job for another worker. '''
+
+    workdir = tempfile.mkdtemp()
+    try:
+      queue = jobs.Queue(os.path.join(workdir, 'queue.db'), lease=60, retries=1)
+      job = queue.submit('/album/*.jpg', '/out.mp4')
+
+      worker = jobs.Worker(queue)
+      def _render(job):
+        raise KeyboardInterrupt()
+      worker._render = _render
+
+      self.assertRaises(KeyboardInterrupt, worker.run, once=True)
+      claimed = queue.claim('other')
+      self.assertEqual((claimed['id'], claimed['attempts']), (job, 1))
+    finally:
+      shutil.rmtree(workdir, ignore_errors=True)
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+'''
+
+  yapa moments demo: cost model tests
+
+'''
+
+# stdlib
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+# local
+from moments import planner
+
+
+def _plan(**overrides):
+
+  ''' Build a run plan like :py:meth:`moments.api.Moment.plan` would. '''
+
+  plan = {
+    'images': 10,
+    'frames_per_image': 36,
+    'frames': 360,
+    'source_pixels': 10 * 4000000,
+    'remote': 0,
+    'size': (1000, 1000),
+    'length': 15,
+    'bitrate': '5000k'
+  }
+  plan.update(overrides)
+  return plan
+
+
+class FeatureTests(unittest.TestCase):
+
+  ''' Tests :py:func:`moments.planner.parse_bitrate` and
+      :py:func:`moments.planner.features`. '''
+
+  def test_parse_bitrate(self):
+
+    ''' Bitrates parse with and without ``k``/``M`` suffixes. '''
+
+    self.assertEqual(planner.parse_bitrate('5000k'), 5000000)
+    self.assertEqual(planner.parse_bitrate('2M'), 2000000)
+    self.assertEqual(planner.parse_bitrate(' 1.5m '), 1500000)
+    self.assertEqual(planner.parse_bitrate(64000), 64000)
+    self.assertIsNone(planner.parse_bitrate('auto'))
+    self.assertIsNone(planner.parse_bitrate(None))
+    self.assertIsNone(planner.parse_bitrate(''))
+
+  def test_features(self):
+
+    ''' Fixed-bitrate plans size their output from the bitrate. '''
+
+    work = planner.features(_plan(remote=4))
+    self.assertEqual(work['remote'], 4)
+    self.assertAlmostEqual(work['resize'], 40 + 360)
+    self.assertAlmostEqual(work['encode'], 360)
+    self.assertAlmostEqual(work['output'], 5000000 * 15 / 8.0)
+    self.assertIsNone(work['pictures'])
+
+  def test_features_constant_quality(self):
+
+    ''' ``auto`` and CRF plans size their output from the new pictures. '''
+
+    for bitrate in ('auto', None):
+      work = planner.features(_plan(bitrate=bitrate))
+      self.assertIsNone(work['output'])
+      self.assertAlmostEqual(work['pictures'], 10)
+
+  def test_features_old_plan(self):
+
+    ''' Plans recorded before fetches were counted are treated as local. '''
+
+    plan = _plan()
+    del plan['remote']
+    self.assertEqual(planner.features(plan)['remote'], 0)
+
+
+class CostModelTests(unittest.TestCase):
+
+  ''' Tests :py:class:`moments.planner.CostModel` calibration and estimates. '''
+
+  def setUp(self):
+
+    ''' Point a fresh model at a scratch directory. '''
+
+    self.workdir = tempfile.mkdtemp()
+    self.path = os.path.join(self.workdir, 'history', 'history.json')
+    self.model = planner.CostModel(self.path)
+
+  def tearDown(self):
+
+    ''' Remove the scratch directory. '''
+
+    shutil.rmtree(self.workdir, ignore_errors=True)
+
+  def test_default_coefficients(self):
+
+    ''' With no history, estimates fall back to the default coefficients. '''
+
+    coefficients = self.model._coefficients([])
+    for quantity, feature, default in planner._MODEL:
+      self.assertEqual(coefficients[(quantity, feature)], default)
+
+    estimate = self.model.estimate(_plan())
+    self.assertEqual(estimate['calibrated_from'], 0)
+    self.assertAlmostEqual(estimate['encode_cpu'], 360 * 0.04)
+    self.assertAlmostEqual(estimate['output_bytes'], 5000000 * 15 / 8.0)
+    self.assertAlmostEqual(estimate['fetch_wall'], 0)
+    self.assertAlmostEqual(estimate['cpu_seconds'],
+                           estimate['fetch_cpu'] + estimate['resize_cpu'] + estimate['encode_cpu'])
+
+  def test_calibration(self):
+
+    ''' Recorded runs calibrate later estimates. '''
+
+    self.model.record(_plan(remote=5), {'fetch_wall': 2.0, 'encode_cpu': 36.0, 'output_bytes': 4687500})
+    self.model.record(_plan(remote=5), {'fetch_wall': 4.0, 'encode_cpu': 108.0, 'output_bytes': 4687500})
+
+    self.assertEqual(len(self.model.load()), 2)
+    estimate = self.model.estimate(_plan(frames=720, remote=10))
+    self.assertEqual(estimate['calibrated_from'], 2)
+    self.assertAlmostEqual(estimate['fetch_wall'], 6.0)  # 0.6 seconds per fetched image
+    self.assertAlmostEqual(estimate['encode_cpu'], 144.0)  # 0.2 CPU seconds per frame-megapixel
+    self.assertAlmostEqual(estimate['resize_cpu'], (40 + 720) * 0.05)  # never measured, so still the default
+
+  def test_constant_quality_fallback(self):
+
+    ''' ``auto`` and CRF plans estimate output size from the ``pictures`` feature. '''
+
+    self.model.record(_plan(bitrate='auto'), {'output_bytes': 3000000})
+    self.model.record(_plan(), {'output_bytes': 9000000})  # fixed-bitrate runs don't skew it
+
+    estimate = self.model.estimate(_plan(bitrate=None, images=20))
+    self.assertAlmostEqual(estimate['output_bytes'], 6000000)
+
+  def test_corrupt_history(self):
+
+    ''' A corrupt history is ignored, then replaced on the next record. '''
+
+    os.makedirs(os.path.dirname(self.path))
+    with open(self.path, 'w') as history:
+      history.write('{"truncated": ')
+
+    self.assertEqual(self.model.load(), [])
+    self.assertEqual(self.model.estimate(_plan())['calibrated_from'], 0)
+
+    self.model.record(_plan(), {'encode_cpu': 1.0})
+    with open(self.path) as history:
+      self.assertEqual(len(json.load(history)), 1)
+
+  def test_history_limit(self):
+
+    ''' Only the most recent runs are kept. '''
+
+    for index in xrange(planner._HISTORY_LIMIT + 5):
+      self.model.record(_plan(), {'encode_cpu': float(index)})
+
+    history = self.model.load()
+    self.assertEqual(len(history), planner._HISTORY_LIMIT)
+    self.assertEqual(history[-1]['measured']['encode_cpu'], planner._HISTORY_LIMIT + 4.0)
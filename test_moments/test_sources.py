@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+
+'''
+
+  yapa moments demo: source fetching tests
+
+'''
+
+# stdlib
+import os
+import time
+import shutil
+import tarfile
+import zipfile
+import tempfile
+import threading
+import unittest
+import warnings
+import SocketServer
+import StringIO
+import BaseHTTPServer
+
+# local
+from moments import sources
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+  ''' Serves a fixed body for every path, except for a few special ones:
+      ``/missing`` (404), ``/flaky`` (503 twice, then OK) and ``/slow``
+      (OK after a delay). Records requests, ranges and connections. '''
+
+  protocol_version = 'HTTP/1.1'  # keep-alive
+
+  def setup(self):
+
+    ''' Count each new connection. '''
+
+    BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+    with self.server.lock:
+      self.server.connections += 1
+
+  def do_GET(self):
+
+    ''' Respond according to the request path. '''
+
+    with self.server.lock:
+      self.server.requests.append((self.path, self.headers.getheader('Range')))
+      flaky = self.path == '/flaky' and len([p for p, _ in self.server.requests if p == '/flaky']) <= 2
+
+    if self.path.startswith('/slow'):
+      time.sleep(0.2)
+
+    status, body = 200, self.server.body
+    if self.path == '/missing':
+      status, body = 404, 'missing'
+    elif flaky:
+      status, body = 503, 'unavailable'
+    elif self.headers.getheader('Range'):
+      status, body = 206, body[:sources._PROBE_BYTES]
+
+    self.send_response(status)
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, *args):
+
+    ''' Keep test output quiet. '''
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+  ''' Threaded local stand-in for an object store. '''
+
+  daemon_threads = True
+
+
+class PoolTests(unittest.TestCase):
+
+  ''' Tests :py:mod:`moments.sources` fetching against a local HTTP server. '''
+
+  def setUp(self):
+
+    ''' Start a local HTTP server, and shorten retry backoff. '''
+
+    self.server = _Server(('127.0.0.1', 0), _Handler)
+    self.server.lock, self.server.requests, self.server.connections = threading.Lock(), [], 0
+    self.server.body = 'x' * (sources._PROBE_BYTES * 2)
+
+    self.thread = threading.Thread(target=self.server.serve_forever)
+    self.thread.daemon = True
+    self.thread.start()
+
+    self.backoff, sources._BACKOFF = sources._BACKOFF, 0.01
+
+  def tearDown(self):
+
+    ''' Stop the server and restore retry backoff. '''
+
+    sources._BACKOFF = self.backoff
+    self.server.shutdown()
+    self.server.server_close()
+
+  def _url(self, path):
+
+    ''' Build a URL against the local server. '''
+
+    return 'http://127.0.0.1:%s%s' % (self.server.server_address[1], path)
+
+  def _requests(self, path):
+
+    ''' Count requests the server saw for ``path``. '''
+
+    return len([p for p, _ in self.server.requests if p == path])
+
+  def test_concurrent_fetch(self):
+
+    ''' Items are fetched concurrently, and all of them arrive. '''
+
+    items = [(i, self._url('/slow/%s' % i)) for i in range(8)]
+    started = time.time()
+    arrived = dict((i, handle.read()) for i, _, handle in sources.stream(items, concurrency=4))
+
+    self.assertEqual(sorted(arrived), range(8))
+    self.assertTrue(all(body == self.server.body for body in arrived.values()))
+    self.assertLess(time.time() - started, 8 * 0.2 * 0.75)
+
+  def test_keepalive_reuse(self):
+
+    ''' Sequential fetches against one host share one connection. '''
+
+    pool = sources.Pool(2)
+    try:
+      for _ in range(3):
+        pool.fetch(self._url('/image.jpg'))
+    finally:
+      pool.close()
+    self.assertEqual(self.server.connections, 1)
+
+  def test_client_error_not_retried(self):
+
+    ''' A 404 fails straight away, and arrives as ``None``. '''
+
+    results = list(sources.stream([(0, self._url('/missing'))]))
+    self.assertEqual(results, [(0, self._url('/missing'), None)])
+    self.assertEqual(self._requests('/missing'), 1)
+
+  def test_server_error_retried(self):
+
+    ''' A 5xx is retried until it succeeds. '''
+
+    pool = sources.Pool(1)
+    try:
+      self.assertEqual(pool.fetch(self._url('/flaky')), self.server.body)
+    finally:
+      pool.close()
+    self.assertEqual(self._requests('/flaky'), 3)
+
+  def test_probe_range(self):
+
+    ''' Probes only ask for the start of each image. '''
+
+    (_, _, handle), = list(sources.stream([(0, self._url('/image.jpg'))], probe=True))
+    self.assertEqual(len(handle.read()), sources._PROBE_BYTES)
+    self.assertEqual(self.server.requests, [('/image.jpg', 'bytes=0-%s' % (sources._PROBE_BYTES - 1))])
+
+  def test_malformed_url(self):
+
+    ''' A URL that can't even be parsed arrives as ``None``, rather than hanging. '''
+
+    self.assertEqual(list(sources.stream([(0, 'http://[::1/a.jpg')])), [(0, 'http://[::1/a.jpg', None)])
+
+
+class ArchiveTests(unittest.TestCase):
+
+  ''' Tests reading :py:mod:`moments.sources` items out of archives. '''
+
+  def setUp(self):
+
+    ''' Create a scratch directory. '''
+
+    self.workdir = tempfile.mkdtemp()
+
+  def tearDown(self):
+
+    ''' Remove the scratch directory. '''
+
+    shutil.rmtree(self.workdir, ignore_errors=True)
+
+  def _tarball(self, *members):
+
+    ''' Write a tarball holding ``(name, data)`` members, in order. '''
+
+    path = os.path.join(self.workdir, 'album.tar.gz')
+    with tarfile.open(path, 'w:gz') as bundle:
+      for name, data in members:
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        bundle.addfile(info, StringIO.StringIO(data))
+    return path
+
+  def _zipball(self, *members, **options):
+
+    ''' Write a zip (named ``album.zip``, unless a ``name`` is given) holding
+        ``(name, data)`` members, in order. '''
+
+    path = os.path.join(self.workdir, options.get('name', 'album.zip'))
+    with warnings.catch_warnings():
+      warnings.simplefilter('ignore')  # zipfile warns about duplicate names, which we want here
+      with zipfile.ZipFile(path, 'w') as bundle:
+        for name, data in members:
+          bundle.writestr(name, data)
+    return path
+
+  def test_member_glob(self):
+
+    ''' Only members matching the inner glob are discovered and read. '''
+
+    path = self._tarball(('a.jpg', 'first'), ('notes.txt', 'skip'), ('b.jpg', 'second'))
+    items = list(enumerate(sources.discover(path + '!*.jpg')))
+
+    self.assertEqual([item for _, item in items], [path + '!a.jpg', path + '!b.jpg'])
+    self.assertEqual([(i, handle.read()) for i, _, handle in sources.stream(items)], [(0, 'first'), (1, 'second')])
+
+  def test_duplicate_members(self):
+
+    ''' Every stored copy of a member is yielded once, in stored order. '''
+
+    for path in (self._tarball(('a.jpg', 'first'), ('a.jpg', 'second')),
+                 self._zipball(('a.jpg', 'first'), ('a.jpg', 'second'))):
+      items = list(enumerate(sources.discover(path)))
+      self.assertEqual([(i, handle.read()) for i, _, handle in sources.stream(items)], [(0, 'first'), (1, 'second')])
+
+  def test_archive_glob(self):
+
+    ''' The archive part of a source may itself be a glob. '''
+
+    first = self._zipball(('a.jpg', 'first'), name='first.zip')
+    second = self._zipball(('b.jpg', 'second'), ('c.txt', 'skip'), name='second.zip')
+    self._tarball(('d.jpg', 'other'))
+    items = sources.discover(os.path.join(self.workdir, '*.zip!*.jpg'))
+
+    self.assertEqual(sorted(items), [first + '!a.jpg', second + '!b.jpg'])
+
+  def test_unreadable_archive(self):
+
+    ''' Missing or corrupt archives are skipped during discovery, not fatal. '''
+
+    corrupt = os.path.join(self.workdir, 'corrupt.tar.gz')
+    with open(corrupt, 'w') as handle:
+      handle.write('not a tarball')
+    path = self._tarball(('a.jpg', 'first'))
+
+    items = sources.discover([os.path.join(self.workdir, 'missing.zip!*.jpg'), corrupt, path])
+    self.assertEqual(items, [path + '!a.jpg'])
+
+  def test_archive_url_is_remote(self):
+
+    ''' A URL that looks like an archive is fetched, not read as a local archive. '''
+
+    url = 'http://127.0.0.1:1/album.zip'
+    backoff, sources._BACKOFF = sources._BACKOFF, 0.01
+    try:
+      self.assertEqual(list(sources.stream([(0, url)])), [(0, url, None)])
+    finally:
+      sources._BACKOFF = backoff